@@ -48,8 +48,6 @@ impl MixnetHandler {
         .parse::<Recipient>()
         .context("Failed to parse recipient address")?;
 
-    println!("🚀 Sending message to: {}", recipient);
-
     self.sender
         .send_message(
             parsed_recipient,
@@ -59,7 +57,6 @@ impl MixnetHandler {
         .await
         .context("Failed to send message with SURBs")?;
 
-    println!("✅ Message sent successfully with 10 SURBs included!");
     Ok(())
 }
 
@@ -1,49 +1,224 @@
-import json
+import orjson
+import random
+import asyncio
 from async_ffi import PyMixnetClient
 from logUtils import logger
 
+CALL_RETRIES = 3  # attempts on the same client before it is treated as dead and replaced
+RETRY_DELAY = 0.5  # seconds before the first retry; doubles on each later one
+SHUTDOWN_FLUSH_TIMEOUT = 5  # seconds shutdown() waits for queued messages to go out
+
 class MixnetConnectionClient:
-    def __init__(self):
+    def __init__(self, max_retries=5):
         self.client = None  # Will be initialized asynchronously
+        self.connected = False
+        self.max_retries = max_retries
+        self._reconnect_lock = asyncio.Lock()  # Only one caller re-runs init() at a time
+        self._message_callback = None  # Re-applied to the new client after a reconnect
+        self._reconnect_callback = None  # Told the new Nym address after a reconnect
+        self._receiving = False  # receive_messages() was started, so a replacement client must listen too
+        self._send_queue = None  # Outbound (recipient, message, sent_future) drained by the writer task
+        self._writer_task = None
 
     async def init(self):
         """
-        Asynchronously initialize the mixnet client.
+        Asynchronously initialize the mixnet client, retrying with exponential backoff and jitter.
+        """
+        for attempt in range(self.max_retries):
+            try:
+                self.client = await PyMixnetClient.create()
+                break
+            except Exception as e:
+                if attempt == self.max_retries - 1:
+                    raise
+                delay = min(30, 2 ** attempt) + random.uniform(0, 0.5)
+                logger.warning(f"Mixnet client init failed ({e}); retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+        if self._message_callback:
+            await self.client.set_message_callback(self._message_callback)
+        self.connected = True
+
+        if self._send_queue is None:
+            self._send_queue = asyncio.Queue()
+        if self._writer_task is None or self._writer_task.done():
+            self._writer_task = asyncio.create_task(self._writer_loop())
+
+    async def _ensure_connected(self):
+        """
+        (Re)initialize the client if needed. Concurrent callers wait on the same
+        reconnect instead of each starting their own.
+        """
+        async with self._reconnect_lock:
+            if not self.connected:
+                await self._bring_up()
+
+    async def _bring_up(self):
+        """
+        init(), and if this replaces a client that was listening, start listening on the
+        new one and report its address (ephemeral clients get a new one every time).
+        """
+        await self.init()
+        if not self._receiving:
+            return
+        # Ask before listening: the listener holds the client's lock for as long as it runs
+        nym_address = await self.client.get_nym_address()
+        await self.client.receive_messages()
+        logger.info(f"Mixnet client replaced; new Nym address: {nym_address}")
+        if self._reconnect_callback:
+            self._reconnect_callback(nym_address)
+
+    async def _replace_client(self, dead_client):
+        """
+        Shut down a client that keeps failing and bring up a new one in its place.
         """
-        self.client = await PyMixnetClient.create()
+        async with self._reconnect_lock:
+            if self.client is not dead_client:
+                return  # Another caller already replaced it
+            logger.warning("Mixnet client keeps failing; replacing it...")
+            self.connected = False
+            try:
+                await dead_client.shutdown()
+            except Exception as e:
+                logger.warning(f"Shutting down the failed mixnet client: {e}")
+            await self._bring_up()
+
+    async def _call(self, method, *args):
+        """
+        Call a PyMixnetClient method. Failures are retried on the same client with a short
+        backoff; only a client that fails CALL_RETRIES times in a row is replaced, since the
+        replacement comes up under a new Nym address.
+        """
+        await self._ensure_connected()
+        for attempt in range(CALL_RETRIES):
+            client = self.client
+            try:
+                return await getattr(client, method)(*args)
+            except Exception as e:
+                if "parse recipient" in str(e):
+                    raise  # A bad address fails the same way on any client
+                logger.warning(f"Mixnet {method} failed ({e}); attempt {attempt + 1} of {CALL_RETRIES}")
+                if attempt < CALL_RETRIES - 1:
+                    await asyncio.sleep(RETRY_DELAY * 2 ** attempt)
+        await self._replace_client(client)
+        return await getattr(self.client, method)(*args)
 
     async def get_nym_address(self):
         """
         Asynchronously retrieve the client's Nym address.
         """
-        return await self.client.get_nym_address()
+        return await self._call("get_nym_address")
 
-    async def send_message(self, message):
+    async def enqueue_message(self, message):
         """
-        Send a message using the async mixnet FFI.
+        Queue a message for the writer task without waiting for it to go out.
         Expects `message` to be a dict with at least 'recipient' and 'message' keys.
+        Returns a Future that resolves once the message has been handed to the mixnet
+        client, or fails with the send error.
         """
         recipient = message.get("recipient")
         msg = message.get("message")
         if not recipient or not msg:
             raise ValueError("Both 'recipient' and 'message' must be provided.")
-        await self.client.send_message(recipient, msg)
+        sent = asyncio.get_running_loop().create_future()
+        await self._send_queue.put((recipient, msg, sent))
+        return sent
+
+    async def send_message(self, message):
+        """
+        Send a message using the async mixnet FFI, via the writer task.
+        Returns once the message has been handed to the mixnet client; raises if that failed.
+        """
+        sent = await self.enqueue_message(message)
+        await sent
+
+    async def flush(self):
+        """
+        Wait until every queued message has been handed to the mixnet client.
+        """
+        await self._send_queue.join()
+
+    async def _writer_loop(self):
+        """
+        Drain the send queue, coalescing everything queued for the same recipient
+        into a single {"batch": [...]} frame so it costs one mixnet send.
+        Each message's future is resolved, or failed, with the send that carried it.
+        """
+        while True:
+            batch = [await self._send_queue.get()]
+            while True:
+                try:
+                    batch.append(self._send_queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+
+            grouped = {}
+            for recipient, msg, sent in batch:
+                grouped.setdefault(recipient, []).append((msg, sent))
+
+            try:
+                for recipient, items in grouped.items():
+                    # A lone message goes out as-is so peers without batch support still understand it
+                    msgs = [msg for msg, _ in items]
+                    payload = msgs[0] if len(msgs) == 1 else orjson.dumps({"batch": msgs}).decode()
+                    try:
+                        await self._call("send_message", recipient, payload)
+                    except Exception as e:
+                        logger.error(f"Failed to send message to {recipient}: {e}")
+                        for _, sent in items:
+                            if not sent.done():
+                                sent.set_exception(e)
+                    else:
+                        for _, sent in items:
+                            if not sent.done():
+                                sent.set_result(None)
+            finally:
+                # Only reached with unresolved futures if the writer is cancelled mid-batch
+                for _, _, sent in batch:
+                    if not sent.done():
+                        sent.cancel()
+                for _ in batch:
+                    self._send_queue.task_done()
 
     async def set_message_callback(self, callback):
         """
         Set a callback function for incoming messages.
         """
-        await self.client.set_message_callback(callback)
+        self._message_callback = callback
+        await self._call("set_message_callback", callback)
+
+    def set_reconnect_callback(self, callback):
+        """
+        Set a callback called with the new Nym address whenever the client is replaced.
+        """
+        self._reconnect_callback = callback
 
     async def receive_messages(self):
         """
         Start receiving messages from the Mixnet.
         """
         logger.info("STARTED MESSAGE RECEIVING LOOP")
-        await self.client.receive_messages()  # Ensure this is awaited properly
+        self._receiving = True
+        await self._call("receive_messages")  # Ensure this is awaited properly
 
-    async def shutdown(self):
+    async def shutdown(self, flush_timeout=SHUTDOWN_FLUSH_TIMEOUT):
         """
-        Asynchronously shut down the mixnet client.
+        Asynchronously shut down the mixnet client, first giving queued messages
+        up to flush_timeout seconds to go out.
         """
+        if self._send_queue is not None:
+            try:
+                await asyncio.wait_for(self.flush(), flush_timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Shutting down with {self._send_queue.qsize()} messages still queued.")
+        if self._writer_task is not None:
+            self._writer_task.cancel()
+            try:
+                await self._writer_task
+            except asyncio.CancelledError:
+                pass
+            self._writer_task = None
+        # Whatever is left will not be sent; don't leave its senders waiting
+        while self._send_queue is not None and not self._send_queue.empty():
+            self._send_queue.get_nowait()[2].cancel()
         await self.client.shutdown()
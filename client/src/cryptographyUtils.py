@@ -1,10 +1,10 @@
 from cryptography.hazmat.primitives.asymmetric import ec
 from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives import hashes, serialization
-from cryptography.hazmat.primitives.asymmetric.utils import encode_dss_signature, decode_dss_signature
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 import os
 import json
+from binascii import unhexlify
 
 class CryptoUtils:
     def __init__(self, storage_dir="storage"):
@@ -82,9 +82,8 @@ class CryptoUtils:
     def verify_signature(self, public_key, message, signature):
         """Verify the authenticity of a signed message."""
         try:
-            r, s = decode_dss_signature(bytes.fromhex(signature))
             public_key.verify(
-                encode_dss_signature(r, s),
+                unhexlify(signature),
                 message.encode(),
                 ec.ECDSA(hashes.SHA256())
             )
@@ -144,7 +143,7 @@ class CryptoUtils:
             # ✅ Extract ephemeral public key and encrypted body
             ephemeral_public_key_pem = encrypted_message["ephemeralPublicKey"]
             encrypted_body = encrypted_message["encryptedBody"]
-            salt = bytes.fromhex(encrypted_message["salt"])
+            salt = unhexlify(encrypted_message["salt"])
 
             ephemeral_public_key = serialization.load_pem_public_key(ephemeral_public_key_pem.encode())
 
@@ -185,9 +184,9 @@ class CryptoUtils:
 
     def _aes_decrypt(self, enc_dict, derived_key):
         """Decrypt an encrypted message using AES-GCM."""
-        iv = bytes.fromhex(enc_dict["iv"])
-        ciphertext = bytes.fromhex(enc_dict["ciphertext"])
-        tag = bytes.fromhex(enc_dict["tag"])
+        iv = unhexlify(enc_dict["iv"])
+        ciphertext = unhexlify(enc_dict["ciphertext"])
+        tag = unhexlify(enc_dict["tag"])
         decryptor = Cipher(algorithms.AES(derived_key), modes.GCM(iv, tag)).decryptor()
         plaintext = decryptor.update(ciphertext) + decryptor.finalize()
         return plaintext.decode()
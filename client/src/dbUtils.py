@@ -1,8 +1,35 @@
 import sqlite3
 import json
 import os
+import re
+import asyncio
+from contextlib import asynccontextmanager
 from datetime import datetime
 
+# Per-user tables are named after the username, so it has to be safe to splice into SQL
+TABLE_USERNAME_RE = re.compile(r"[A-Za-z0-9_-]+")
+
+READ_POOL_SIZE = 4  # read connections handed out by SQLiteManager.read()
+
+GET_CONTACT_SQL = """
+    SELECT username, public_key
+    FROM {contacts}
+    WHERE username = ?
+"""
+
+MESSAGES_BY_CONTACT_SQL = """
+    SELECT type, message, timestamp
+    FROM {messages}
+    WHERE username = ?
+    ORDER BY timestamp ASC
+"""
+
+ALL_MESSAGES_SQL = """
+    SELECT username, type, message, timestamp
+    FROM {messages}
+    ORDER BY username, id ASC
+"""
+
 class SQLiteManager:
     def __init__(self, username, storage_dir="storage"):
         """
@@ -14,10 +41,67 @@ class SQLiteManager:
         if not os.path.exists(user_dir):
             os.makedirs(user_dir)
 
-        db_path = os.path.join(user_dir, f"{username}_client.db")
-        self.conn = sqlite3.connect(db_path)
+        self.db_path = os.path.join(user_dir, f"{username}_client.db")
+        # One write connection is kept open for the whole session; WAL lets the
+        # pooled read connections proceed while it writes
+        self.conn = self._connect()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self._sql_cache = {}  # {(template, username): sql} so sqlite3's statement cache sees identical strings
+        self._read_pool = None  # asyncio.Queue of read connections, opened on first read()
+        self._write_lock = asyncio.Lock()
         self.create_global_tables()
 
+    def _connect(self):
+        """
+        Open a connection with the session tuning applied.
+        Connections may be used from worker threads via asyncio.to_thread.
+        """
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, cached_statements=256)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA cache_size=-20000")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    @asynccontextmanager
+    async def read(self):
+        """
+        Borrow one of the pooled read connections:
+            async with db.read() as conn: ...
+        """
+        if self._read_pool is None:
+            self._read_pool = asyncio.Queue()
+            for _ in range(READ_POOL_SIZE):
+                self._read_pool.put_nowait(self._connect())
+        conn = await self._read_pool.get()
+        try:
+            yield conn
+        finally:
+            self._read_pool.put_nowait(conn)
+
+    async def write(self, method, *args, **kwargs):
+        """
+        Run a write method (e.g. self.save_message) in a worker thread so the
+        event loop keeps ticking. Writers are serialized on one lock.
+        Once the session is running, every write on self.conn must go through here;
+        a direct call from the event loop could commit in the middle of a worker's transaction.
+        """
+        async with self._write_lock:
+            return await asyncio.to_thread(method, *args, **kwargs)
+
+    def _sql(self, template, username):
+        """
+        Fill the {contacts}/{messages} table names in template for username.
+        Built once per (template, username) and reused on every later call.
+        """
+        key = (template, username)
+        sql = self._sql_cache.get(key)
+        if sql is None:
+            if not username or not TABLE_USERNAME_RE.fullmatch(username):
+                raise ValueError(f"Invalid username for table name: {username!r}")
+            sql = template.format(contacts=f'"contacts_{username}"', messages=f'"messages_{username}"')
+            self._sql_cache[key] = sql
+        return sql
+
     def create_global_tables(self):
         """
         Create global tables to track users.
@@ -37,22 +121,22 @@ class SQLiteManager:
         """
         with self.conn:
             # Contacts table for the specific user now stores username and public_key
-            self.conn.execute(f"""
-                CREATE TABLE IF NOT EXISTS contacts_{username} (
+            self.conn.execute(self._sql("""
+                CREATE TABLE IF NOT EXISTS {contacts} (
                     username TEXT PRIMARY KEY,
                     public_key TEXT NOT NULL
                 )
-            """)
+            """, username))
             # Messages table for the specific user remains unchanged
-            self.conn.execute(f"""
-                CREATE TABLE IF NOT EXISTS messages_{username} (
+            self.conn.execute(self._sql("""
+                CREATE TABLE IF NOT EXISTS {messages} (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     username TEXT NOT NULL,
                     type TEXT CHECK(type IN ('to', 'from')) NOT NULL,
                     message TEXT NOT NULL,
                     timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
                 )
-            """)
+            """, username))
 
     def register_user(self, username, public_key):
         """
@@ -72,10 +156,10 @@ class SQLiteManager:
         Add or update a contact for the specified active user.
         """
         with self.conn:
-            self.conn.execute(f"""
-                INSERT OR REPLACE INTO contacts_{active_user} (username, public_key)
+            self.conn.execute(self._sql("""
+                INSERT OR REPLACE INTO {contacts} (username, public_key)
                 VALUES (?, ?)
-            """, (contact_username, public_key))
+            """, active_user), (contact_username, public_key))
 
     def get_contact(self, active_user, contact_username):
         """
@@ -83,67 +167,93 @@ class SQLiteManager:
         Returns (username, public_key) if found.
         """
         with self.conn:
-            return self.conn.execute(f"""
-                SELECT username, public_key
-                FROM contacts_{active_user}
-                WHERE username = ?
-            """, (contact_username,)).fetchone()
+            return self.conn.execute(
+                self._sql(GET_CONTACT_SQL, active_user), (contact_username,)
+            ).fetchone()
+
+    async def get_contact_async(self, active_user, contact_username):
+        """
+        Same as get_contact, using a pooled read connection off the event loop.
+        """
+        sql = self._sql(GET_CONTACT_SQL, active_user)
+        async with self.read() as conn:
+            return await asyncio.to_thread(lambda: conn.execute(sql, (contact_username,)).fetchone())
 
     def get_all_contacts(self, active_user):
         """
         Retrieve all contacts for the specified active user.
         """
         with self.conn:
-            return self.conn.execute(f"SELECT * FROM contacts_{active_user}").fetchall()
+            return self.conn.execute(self._sql("SELECT * FROM {contacts}", active_user)).fetchall()
 
     def save_message(self, active_user, contact_username, msg_type, message):
         """
         Save a message for the specified active user.
         """
         with self.conn:
-            self.conn.execute(f"""
-                INSERT INTO messages_{active_user} (username, type, message)
+            self.conn.execute(self._sql("""
+                INSERT INTO {messages} (username, type, message)
+                VALUES (?, ?, ?)
+            """, active_user), (contact_username, msg_type, message))
+
+    def save_messages(self, active_user, rows):
+        """
+        Save several messages for the specified active user in one transaction.
+        :param rows: iterable of (contact_username, msg_type, message)
+        """
+        with self.conn:
+            self.conn.executemany(self._sql("""
+                INSERT INTO {messages} (username, type, message)
                 VALUES (?, ?, ?)
-            """, (contact_username, msg_type, message))
+            """, active_user), rows)
 
     def get_messages_by_contact(self, active_user, contact_username):
         """
         Retrieve all messages exchanged with a specific contact for the active user.
         """
         with self.conn:
-            return self.conn.execute(f"""
-                SELECT type, message, timestamp
-                FROM messages_{active_user}
-                WHERE username = ?
-                ORDER BY timestamp ASC
-            """, (contact_username,)).fetchall()
+            return self.conn.execute(
+                self._sql(MESSAGES_BY_CONTACT_SQL, active_user), (contact_username,)
+            ).fetchall()
+
+    async def get_messages_by_contact_async(self, active_user, contact_username):
+        """
+        Same as get_messages_by_contact, using a pooled read connection off the event loop.
+        """
+        sql = self._sql(MESSAGES_BY_CONTACT_SQL, active_user)
+        async with self.read() as conn:
+            return await asyncio.to_thread(lambda: conn.execute(sql, (contact_username,)).fetchall())
 
     def get_all_messages(self, active_user):
         """
         Retrieve all messages for the specified active user.
         """
         with self.conn:
-            return self.conn.execute(f"""
-                SELECT username, type, message, timestamp
-                FROM messages_{active_user}
-                ORDER BY username, timestamp ASC
-            """).fetchall()
+            return self.conn.execute(self._sql(ALL_MESSAGES_SQL, active_user)).fetchall()
+
+    async def get_all_messages_async(self, active_user):
+        """
+        Same as get_all_messages, using a pooled read connection off the event loop.
+        """
+        sql = self._sql(ALL_MESSAGES_SQL, active_user)
+        async with self.read() as conn:
+            return await asyncio.to_thread(lambda: conn.execute(sql).fetchall())
 
     def delete_contact(self, active_user, contact_username):
         """
         Delete a contact for the specified active user.
         """
         with self.conn:
-            self.conn.execute(f"""
-                DELETE FROM contacts_{active_user} WHERE username = ?
-            """, (contact_username,))
+            self.conn.execute(self._sql("""
+                DELETE FROM {contacts} WHERE username = ?
+            """, active_user), (contact_username,))
 
     def delete_all_messages(self, active_user):
         """
         Delete all messages for the specified active user.
         """
         with self.conn:
-            self.conn.execute(f"DELETE FROM messages_{active_user}")
+            self.conn.execute(self._sql("DELETE FROM {messages}", active_user))
 
     def get_all_users(self):
         """
@@ -156,4 +266,7 @@ class SQLiteManager:
         """
         Close the database connection.
         """
+        if self._read_pool is not None:
+            while not self._read_pool.empty():
+                self._read_pool.get_nowait().close()
         self.conn.close()
@@ -1,16 +1,30 @@
+import atexit
 import logging
 import os
+import queue
+from logging.handlers import QueueHandler, QueueListener
 
 # Configure logging
 LOG_FILE = os.path.join(os.getcwd(), "storage", "app.log")
 
+_formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(name)s - %(message)s")
+_file_handler = logging.FileHandler(LOG_FILE)  # Log to file
+_file_handler.setFormatter(_formatter)
+_stream_handler = logging.StreamHandler()  # Log to console
+_stream_handler.setFormatter(_formatter)
+
+# Loggers only enqueue records; the listener thread does the file/console writes
+_log_queue = queue.SimpleQueue()
+_listener = QueueListener(_log_queue, _file_handler, _stream_handler, respect_handler_level=True)
+_listener.start()
+atexit.register(_listener.stop)
+
+_queue_handler = QueueHandler(_log_queue)
+_queue_handler.setFormatter(logging.Formatter("%(message)s"))  # merge args only; the listener's handlers add the prefix
+
 logging.basicConfig(
     level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(name)s - %(message)s",
-    handlers=[
-        logging.FileHandler(LOG_FILE),  # Log to file
-        logging.StreamHandler()  # Log to console
-    ]
+    handlers=[_queue_handler]
 )
 
 logger = logging.getLogger("AppLogger")
@@ -1,7 +1,8 @@
 import json
 import asyncio
+import orjson
+import time
 from nicegui import ui
-from datetime import datetime
 from cryptography.hazmat.primitives import serialization
 from mixnetMessages import MixnetMessage
 from cryptographyUtils import CryptoUtils
@@ -9,6 +10,20 @@ from connectionUtils import MixnetConnectionClient
 from dbUtils import SQLiteManager
 from logUtils import logger
 
+INBOUND_QUEUE_SIZE = 1024  # raw inbound messages buffered before the oldest get dropped
+INBOUND_BATCH_SIZE = 64    # most inbound messages handled per consumer wake-up
+INBOUND_YIELD_EVERY = 8    # hand the loop back to the UI after this many inbound messages...
+INBOUND_TIME_BUDGET = 0.02 # ...or after this many seconds, whichever comes first
+
+def message_timestamp():
+    """Local time as 'YYYY-MM-DD HH:MM:SS', built from struct_time fields instead of strftime."""
+    t = time.localtime()
+    return f"{t.tm_year:04d}-{t.tm_mon:02d}-{t.tm_mday:02d} {t.tm_hour:02d}:{t.tm_min:02d}:{t.tm_sec:02d}"
+
+def split_message_lines(text):
+    """Split multi-line text once, when stored, so the chat UI can render it as-is."""
+    return text.split("\n") if "\n" in text else text
+
 class MessageHandler:
     def __init__(self, crypto_utils: CryptoUtils, connection_client: MixnetConnectionClient):
         self.crypto_utils = crypto_utils
@@ -29,12 +44,20 @@ class MessageHandler:
         self.query_result_event = asyncio.Event()
         self.query_result = None
 
+        # Inbound messages from the mixnet callback, drained by process_incoming_queue
+        self.inbound_queue = asyncio.Queue(maxsize=INBOUND_QUEUE_SIZE)
+        self._pending_rows = None  # Chat rows collected while a batch is handled, then saved together
+
+        # Outgoing direct messages, drained in order by _outbox_loop
+        self._outbox = None
+        self._outbox_task = None
+
         # [OPTIONAL] references to UI or chat state
         self.chat_messages = None
         self.chat_list = None
         self.active_chat = None
         self.render_chat_fn = None
-        self.chat_list_sidebar_fn = None  # For refreshing the chat list sidebar
+        self.chat_list_sidebar_fn = None  # Called when a new chat is added to the sidebar
         self.chat_container = None
         self.new_message_callback = None  # To notify UI of new messages
 
@@ -60,7 +83,7 @@ class MessageHandler:
         self._get_active_chat = get_active_chat
         self.render_chat_fn = render_chat
         self.chat_container = chat_container
-        self.chat_list_sidebar_fn = chat_list_sidebar_fn  # Store reference for sidebar refresh
+        self.chat_list_sidebar_fn = chat_list_sidebar_fn  # Store reference for sidebar updates
 
     # --------------------------------------------------------------------------
     # Registration & Login
@@ -190,7 +213,7 @@ class MessageHandler:
             try:
                 self.db_manager = SQLiteManager(username)
                 logger.info("DB manager created.")
-                self.db_manager.create_user_tables(username)
+                await self.db_manager.write(self.db_manager.create_user_tables, username)
             except Exception as e:
                 logger.error(f"DB init: {e}")
                 self.login_successful = False
@@ -208,25 +231,86 @@ class MessageHandler:
     # --------------------------------------------------------------------------
     # Sending Direct Messages (All messages encrypted)
     # --------------------------------------------------------------------------
+    def queue_direct_message(self, recipient_username, message_content):
+        """
+        Queue a direct message for _outbox_loop and return a Future that completes once it
+        has been sent and stored, or fails with the send error. Messages go out on the wire,
+        and are stored, in the order they were queued.
+        """
+        if self._outbox is None:
+            self._outbox = asyncio.Queue()
+        if self._outbox_task is None or self._outbox_task.done():
+            self._outbox_task = asyncio.create_task(self._outbox_loop())
+        done = asyncio.get_running_loop().create_future()
+        self._outbox.put_nowait((recipient_username, message_content, done))
+        return done
+
     async def send_direct_message(self, recipient_username, message_content):
+        await self.queue_direct_message(recipient_username, message_content)
+
+    async def _outbox_loop(self):
+        """
+        Single consumer of the outbox. Every waiting message is built and handed to the
+        connection's writer first (so it can batch them), then each send is awaited and
+        stored in the same order.
+        """
+        while True:
+            jobs = [await self._outbox.get()]
+            while not self._outbox.empty():
+                jobs.append(self._outbox.get_nowait())
+
+            queued = []
+            for recipient_username, message_content, done in jobs:
+                try:
+                    sent = await self._enqueue_direct_message(recipient_username, message_content)
+                except Exception as e:
+                    done.set_exception(e)
+                    continue
+                queued.append((recipient_username, message_content, sent, done))
+
+            for recipient_username, message_content, sent, done in queued:
+                await asyncio.wait((sent,))
+                if sent.cancelled():
+                    done.cancel()
+                    continue
+                if sent.exception() is not None:
+                    done.set_exception(sent.exception())
+                    continue
+                logger.info(f"Sent direct message to {recipient_username}")
+                try:
+                    await self.db_manager.write(
+                        self.db_manager.save_message,
+                        self.current_user["username"],
+                        contact_username=recipient_username,
+                        msg_type='to',
+                        message=message_content
+                    )
+                except Exception as e:
+                    done.set_exception(e)
+                    continue
+                done.set_result(None)
+
+    async def _enqueue_direct_message(self, recipient_username, message_content):
+        """
+        Build, encrypt and sign a direct message and queue it on the connection.
+        Returns the connection's sent-Future; raises if the message cannot be sent at all,
+        so the caller's "failed to send" marker fires.
+        """
         if not recipient_username or not message_content.strip():
-            return
+            raise ValueError("Both a recipient and a non-empty message are required.")
 
         sender_private_key = self.crypto_utils.load_private_key(self.current_user["username"])
         if not sender_private_key:
-            logger.error("No private key to send message.")
-            return
+            raise RuntimeError("No private key to send message.")
 
         if not self.db_manager:
-            logger.error("DB manager not initialized.")
-            return
+            raise RuntimeError("DB manager not initialized.")
 
-        contact = self.db_manager.get_contact(self.current_user["username"], recipient_username)
+        contact = await self.db_manager.get_contact_async(self.current_user["username"], recipient_username)
         if not contact:
-            logger.error(f"No contact record found for {recipient_username}. Cannot send message.")
-            return
+            raise RuntimeError(f"No contact record found for {recipient_username}. Cannot send message.")
 
-        existing_msgs = self.db_manager.get_messages_by_contact(self.current_user["username"], recipient_username)
+        existing_msgs = await self.db_manager.get_messages_by_contact_async(self.current_user["username"], recipient_username)
         initial_message = not existing_msgs
 
         recipient_public_key_pem = contact[1]
@@ -275,15 +359,7 @@ class MessageHandler:
         else:
             msg = MixnetMessage.send(content=payload_str, signature=outer_signature)
 
-        await self.connection_client.send_message(msg)
-        logger.info(f"Sent direct message to {recipient_username}")
-
-        self.db_manager.save_message(
-            self.current_user["username"],
-            contact_username=recipient_username,
-            msg_type='to',
-            message=message_content
-        )
+        return await self.connection_client.enqueue_message(msg)
 
 
     async def send_handshake(self, recipient_username):
@@ -303,7 +379,7 @@ class MessageHandler:
             logger.error("DB manager not initialized.")
             return
 
-        contact = self.db_manager.get_contact(self.current_user["username"], recipient_username)
+        contact = await self.db_manager.get_contact_async(self.current_user["username"], recipient_username)
         if not contact:
             logger.error(f"No contact record found for {recipient_username}. Cannot send handshake.")
             return
@@ -371,15 +447,80 @@ class MessageHandler:
             username = content.get("username")
             public_key = content.get("publicKey")
             if username and public_key:
-                self.db_manager.add_contact(self.current_user["username"], username, public_key)
+                await self.db_manager.write(self.db_manager.add_contact, self.current_user["username"], username, public_key)
 
     # --------------------------------------------------------------------------
     # Handling Incoming Messages (SINGLE CALLBACK)
     # --------------------------------------------------------------------------
+    def enqueue_incoming(self, message):
+        """
+        Queue a raw inbound message for process_incoming_queue.
+        If the consumer has fallen behind, the oldest queued message is dropped.
+        """
+        if self.inbound_queue.full():
+            self.inbound_queue.get_nowait()
+            logger.warning("Inbound queue full; dropped the oldest message.")
+        self.inbound_queue.put_nowait(message)
+
+    async def process_incoming_queue(self):
+        """ Consume inbound messages in batches of up to INBOUND_BATCH_SIZE """
+        while True:
+            batch = [await self.inbound_queue.get()]
+            while not self.inbound_queue.empty() and len(batch) < INBOUND_BATCH_SIZE:
+                batch.append(self.inbound_queue.get_nowait())
+            # This is the only reader of the inbound queue; one bad batch must not end it
+            try:
+                await self.handle_incoming_batch(batch)
+            except Exception as e:
+                logger.error(f"Failed to handle incoming batch: {e}")
+
+    async def handle_incoming_batch(self, batch):
+        """
+        Handle a batch of raw inbound messages; one bad message does not stop the rest.
+        Chat messages from the batch are stored with a single executemany / commit.
+        """
+        self._pending_rows = []
+        try:
+            started = time.monotonic()
+            for handled, message in enumerate(batch, 1):
+                try:
+                    await self.handle_incoming_message(message)
+                except Exception as e:
+                    logger.error(f"Failed to handle incoming message: {e}")
+                # Decrypt/verify is CPU-bound; yield so the UI keeps painting during catch-up
+                if handled % INBOUND_YIELD_EVERY == 0 or time.monotonic() - started > INBOUND_TIME_BUDGET:
+                    await asyncio.sleep(0)
+                    started = time.monotonic()
+        finally:
+            rows, self._pending_rows = self._pending_rows, None
+            if rows and self.db_manager:
+                await self._store_rows(rows)
+
+    async def _store_rows(self, rows):
+        """ Store a batch's chat rows in one transaction, falling back to one row at a time if that fails """
+        username = self.current_user["username"]
+        try:
+            await self.db_manager.write(self.db_manager.save_messages, username, rows)
+            logger.info(f"Stored {len(rows)} incoming messages in DB.")
+            return
+        except Exception as e:
+            logger.error(f"Storing {len(rows)} incoming messages failed ({e}); retrying one at a time")
+        for from_user, msg_type, message in rows:
+            try:
+                await self.db_manager.write(self.db_manager.save_message, username, from_user, msg_type, message)
+            except Exception as e:
+                logger.error(f"Failed to store incoming message from {from_user}: {e}")
+
     async def handle_incoming_message(self, message):
         """ Main dispatcher for handling messages """
         try:
-            encapsulated_data = json.loads(message)
+            encapsulated_data = orjson.loads(message)
+            if "batch" in encapsulated_data:
+                # Several messages coalesced into one mixnet send by the sender's writer
+                for item in encapsulated_data["batch"]:
+                    await self.handle_incoming_message(item)
+                return
+
             action = encapsulated_data.get("action")
             context = encapsulated_data.get("context")
             content = self._parse_content(encapsulated_data.get("content"))
@@ -396,7 +537,7 @@ class MessageHandler:
         """ Ensure content is a dictionary, converting if necessary """
         if isinstance(content, str):
             try:
-                return json.loads(content)
+                return orjson.loads(content)
             except json.JSONDecodeError:
                 pass
         return content
@@ -445,14 +586,14 @@ class MessageHandler:
         logger.info(f"Received message from {from_user}")
 
         # Retrieve sender's stored long-term public key (for signature verification)
-        contact = self.db_manager.get_contact(self.current_user["username"], from_user) if self.db_manager else None
+        contact = await self.db_manager.get_contact_async(self.current_user["username"], from_user) if self.db_manager else None
         sender_public_key_pem = contact[1] if contact else None
 
         # If this is the first contact, store the sender's public key
         if sender_pub_from_msg:
             if not sender_public_key_pem:  # First-time contact
                 logger.info(f"Storing new sender public key for {from_user}")
-                self.db_manager.add_contact(self.current_user["username"], from_user, sender_pub_from_msg)
+                await self.db_manager.write(self.db_manager.add_contact, self.current_user["username"], from_user, sender_pub_from_msg)
                 sender_public_key_pem = sender_pub_from_msg  #  Use this for signature verification
 
         # If we still don't have a long-term public key, we cannot verify the signature
@@ -493,7 +634,7 @@ class MessageHandler:
 
         # Step 4: Parse JSON 
         try:
-            message_obj = json.loads(decrypted_message)
+            message_obj = orjson.loads(decrypted_message)
         except json.JSONDecodeError:
             logger.error("Decrypted message not valid JSON")
             return None
@@ -509,18 +650,17 @@ class MessageHandler:
 
         # Step 6 Handle normal message storage
         if from_user and actual_message and self.db_manager:
-            self._store_message(from_user, actual_message)
-            logger.info(f"Stored incoming message from {from_user} in DB.")
+            await self._store_message(from_user, actual_message)
 
             # Update the chat UI
             self._update_chat_ui(from_user, actual_message)
 
 
-    def _verify_and_decrypt_message(self, encrypted_payload, signature, from_user):
+    async def _verify_and_decrypt_message(self, encrypted_payload, signature, from_user):
         """ Calls CryptoUtils to verify the signature and then decrypt the message """
 
         # Retrieve sender's stored public key
-        contact = self.db_manager.get_contact(self.current_user["username"], from_user) if self.db_manager else None
+        contact = await self.db_manager.get_contact_async(self.current_user["username"], from_user) if self.db_manager else None
         sender_public_key_pem = contact[1] if contact else None
 
         if not sender_public_key_pem:
@@ -566,7 +706,7 @@ class MessageHandler:
         - If it's plaintext, wrap it in {"type": 0, "message": decrypted_msg}.
         """
         try:
-            parsed_message = json.loads(decrypted_msg)  # Try parsing JSON
+            parsed_message = orjson.loads(decrypted_msg)  # Try parsing JSON
             if isinstance(parsed_message, dict):
                 return parsed_message
         except json.JSONDecodeError:
@@ -582,33 +722,37 @@ class MessageHandler:
     #     else:
     #         logger.warning(f"Handshake message from {from_user} missing nym address.")
 
-    def _store_message(self, from_user, actual_message):
-        """ Stores message in the database """
-        self.db_manager.save_message(self.current_user["username"], from_user, 'from', actual_message)
+    async def _store_message(self, from_user, actual_message):
+        """ Stores message in the database (deferred to the end of the batch when batching) """
+        if self._pending_rows is not None:
+            self._pending_rows.append((from_user, 'from', actual_message))
+            return
+        await self.db_manager.write(
+            self.db_manager.save_message, self.current_user["username"], from_user, 'from', actual_message
+        )
         logger.info(f"Stored incoming message from {from_user} in DB.")
 
     def _update_chat_ui(self, from_user, actual_message):
         """ Updates chat messages and UI elements """
-        if self.chat_messages is None:
+        chat_messages = self.chat_messages
+        if chat_messages is None:
             logger.warning("chat_messages is None; UI might not be initialized.")
             return
 
-        if from_user not in self.chat_messages:
-            self.chat_messages[from_user] = []
-
-        stamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        self.chat_messages[from_user].append((from_user, actual_message, stamp))
+        stamp = message_timestamp()
+        chat_messages.setdefault(from_user, []).append((False, split_message_lines(actual_message), stamp))
 
-        if not any(chat["id"] == from_user for chat in self.chat_list):
-            self.chat_list.append({"id": from_user, "name": from_user})
+        chat_list = self.chat_list
+        if not any(chat["id"] == from_user for chat in chat_list):
+            chat_list.append({"id": from_user, "name": from_user})
             if self.chat_list_sidebar_fn:
-                self.chat_list_sidebar_fn.refresh()
+                self.chat_list_sidebar_fn()
             logger.info(f"Added {from_user} to chat list.")
 
         currently_active_chat = self._get_active_chat()
         if from_user == currently_active_chat and self.render_chat_fn:
             try:
-                self.render_chat_fn.refresh(self.current_user["username"], currently_active_chat, self.chat_messages)
+                self.render_chat_fn(self.current_user["username"], currently_active_chat, chat_messages)
                 logger.info("Chat UI refreshed successfully.")
             except Exception as e:
                 logger.error(f"Failed to refresh chat UI: {e}")
@@ -1,64 +1,83 @@
-import json
 import os
+import orjson
 
 
 def load_env(filepath=".env"):
-    """Load environment variables from a .env file into os.environ."""
-    if os.path.exists(filepath):
-        with open(filepath) as f:
+    """Load environment variables from a .env file into os.environ (once per process tree)."""
+    path = os.path.abspath(filepath)
+    if os.environ.get("_ENV_LOADED") == path:
+        return
+    if os.path.exists(path):
+        with open(path) as f:
             for line in f:
                 # Ignore empty lines and comments
                 if line.strip() and not line.startswith("#"):
                     key, value = line.strip().split("=", 1)
                     os.environ[key] = value
+        os.environ["_ENV_LOADED"] = path
 
 load_env()
 
 SERVER_ADDRESS = os.getenv("SERVER_ADDRESS")
 
+_dumps = orjson.dumps  # bound once; the encoders below are on the send path
+
+
+def _enc(value):
+    """JSON-encode a single field value (quotes and escaping) as str."""
+    return _dumps(value).decode()
+
+# Envelope templates: the action keys are fixed, so only the variable fields get encoded per call
+_QUERY_TMPL = '{"action":"query","username":%s}'
+_REGISTER_TMPL = '{"action":"register","usernym":%s,"publicKey":%s}'
+_LOGIN_TMPL = '{"action":"login","usernym":%s}'
+_UPDATE_TMPL = '{"action":"update","field":%s,"value":%s,"signature":%s}'
+_SEND_TMPL = '{"action":"send","content":%s,"signature":%s}'
+_DIRECT_TMPL = '{"action":"incomingMessage","content":%s,"context":"chat","signature":%s}'
+_SEND_GROUP_TMPL = '{"action":"sendGroup","target":%s,"content":%s,"signature":%s}'
+_CREATE_GROUP_TMPL = '{"action":"createGroup","signature":%s}'
+_INVITE_GROUP_TMPL = '{"action":"inviteGroup","target":%s,"groupID":%s,"signature":%s}'
+_REGISTRATION_RESPONSE_TMPL = '{"action":"registrationResponse","username":%s,"signature":%s}'
+_LOGIN_RESPONSE_TMPL = '{"action":"loginResponse","username":%s,"signature":%s}'
+
 class MixnetMessage:
     @staticmethod
-    def query(usernym):
-        encapsulatedMessage = json.dumps({"action": "query", "username": usernym})
+    def query(usernym, _addr=SERVER_ADDRESS):
         return {
-            "message": encapsulatedMessage,
-            "recipient": SERVER_ADDRESS,
+            "message": _QUERY_TMPL % _enc(usernym),
+            "recipient": _addr,
         }
 
     @staticmethod
-    def register(usernym, publicKey):
-        encapsulatedMessage = json.dumps({"action": "register", "usernym": usernym, "publicKey": publicKey})
+    def register(usernym, publicKey, _addr=SERVER_ADDRESS):
         return {
-            "message": encapsulatedMessage,
-            "recipient": SERVER_ADDRESS,
+            "message": _REGISTER_TMPL % (_enc(usernym), _enc(publicKey)),
+            "recipient": _addr,
         }
 
     @staticmethod
-    def login(usernym):
-        encapsulatedMessage = json.dumps({"action": "login", "usernym": usernym})
+    def login(usernym, _addr=SERVER_ADDRESS):
         return {
-            "message": encapsulatedMessage,
-            "recipient": SERVER_ADDRESS,
+            "message": _LOGIN_TMPL % _enc(usernym),
+            "recipient": _addr,
         }
 
     @staticmethod
-    def update(field, value, signature):
-        encapsulatedMessage = json.dumps({"action": "update", "field": field, "value": value, "signature": signature})
+    def update(field, value, signature, _addr=SERVER_ADDRESS):
         return {
-            "message": encapsulatedMessage,
-            "recipient": SERVER_ADDRESS,
+            "message": _UPDATE_TMPL % (_enc(field), _enc(value), _enc(signature)),
+            "recipient": _addr,
         }
 
     @staticmethod
-    def send(content, signature):
+    def send(content, signature, _addr=SERVER_ADDRESS):
         """
         Encapsulates a message for sending via the centralized server.
         This is used for handshake messages (to hide it from the server) and is not appropriate for p2p direct messaging.
         """
-        encapsulatedMessage = json.dumps({"action": "send", "content": content, "signature": signature})
         return {
-            "message": encapsulatedMessage,
-            "recipient": SERVER_ADDRESS,
+            "message": _SEND_TMPL % (_enc(content), _enc(signature)),
+            "recipient": _addr,
         }
 
     @staticmethod
@@ -67,63 +86,43 @@ class MixnetMessage:
         Encapsulates a p2p direct message in the format expected by the receiving client.
         The resulting JSON has an action of 'incomingMessage' and a context of 'chat'.
         """
-        encapsulatedMessage = json.dumps({
-            "action": "incomingMessage",
-            "content": content,
-            "context": "chat",
-            "signature": signature
-        })
         # The recipient field can be overridden if a direct p2p address is available.
         return {
-            "message": encapsulatedMessage,
+            "message": _DIRECT_TMPL % (_enc(content), _enc(signature)),
             "recipient": ""  # This field can be set externally
         }
 
     @staticmethod
-    def sendGroup(groupID, content, signature):
-        encapsulatedMessage = json.dumps({"action": "sendGroup", "target": groupID, "content": content, "signature": signature})
+    def sendGroup(groupID, content, signature, _addr=SERVER_ADDRESS):
         return {
-            "message": encapsulatedMessage,
-            "recipient": SERVER_ADDRESS,
+            "message": _SEND_GROUP_TMPL % (_enc(groupID), _enc(content), _enc(signature)),
+            "recipient": _addr,
         }
 
     @staticmethod
-    def createGroup(signature):
-        encapsulatedMessage = json.dumps({"action": "createGroup", "signature": signature})
+    def createGroup(signature, _addr=SERVER_ADDRESS):
         return {
-            "message": encapsulatedMessage,
-            "recipient": SERVER_ADDRESS,
+            "message": _CREATE_GROUP_TMPL % _enc(signature),
+            "recipient": _addr,
         }
 
     @staticmethod
-    def inviteGroup(usernym, groupID, signature):
-        encapsulatedMessage = json.dumps({"action": "inviteGroup", "target": usernym, "groupID": groupID, "signature": signature})
+    def inviteGroup(usernym, groupID, signature, _addr=SERVER_ADDRESS):
         return {
-            "message": encapsulatedMessage,
-            "recipient": SERVER_ADDRESS,
+            "message": _INVITE_GROUP_TMPL % (_enc(usernym), _enc(groupID), _enc(signature)),
+            "recipient": _addr,
         }
 
     @staticmethod
-    def registrationResponse(username, signature):
-        encapsulatedMessage = json.dumps({
-            "action": "registrationResponse",
-            "username": username,
-            "signature": signature,
-        })
+    def registrationResponse(username, signature, _addr=SERVER_ADDRESS):
         return {
-            "message": encapsulatedMessage,
-            "recipient": SERVER_ADDRESS,
+            "message": _REGISTRATION_RESPONSE_TMPL % (_enc(username), _enc(signature)),
+            "recipient": _addr,
         }
 
     @staticmethod
-    def loginResponse(username, signature):
-        encapsulatedMessage = json.dumps({
-            "action": "loginResponse",
-            "username": username,
-            "signature": signature,
-        })
+    def loginResponse(username, signature, _addr=SERVER_ADDRESS):
         return {
-            "message": encapsulatedMessage,
-            "recipient": SERVER_ADDRESS,
+            "message": _LOGIN_RESPONSE_TMPL % (_enc(username), _enc(signature)),
+            "recipient": _addr,
         }
-
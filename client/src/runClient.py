@@ -1,15 +1,16 @@
 # runClient.py
-import threading
 import os
 import asyncio
+import itertools
+import operator
+import time
 from nicegui import ui, app
 from uuid import uuid4
-from datetime import datetime
 
 from dbUtils import SQLiteManager
 from cryptographyUtils import CryptoUtils
 from connectionUtils import MixnetConnectionClient
-from messageHandler import MessageHandler
+from messageHandler import MessageHandler, message_timestamp, split_message_lines
 from logUtils import logger
 
 ###############################################################################
@@ -17,13 +18,39 @@ from logUtils import logger
 ###############################################################################
 DB_DIR = os.path.join(os.getcwd(), "storage")
 usernames = []
+_users_scan_cache = {}  # {dir: (mtime, usernames)}
 
 chat_list = []        # [{"id": <username>, "name": <username>}]
 active_chat = None    # currently active chat user ID
 active_chat_user = None
-messages = {}         # {username: [(sender_id, msg_text, timestamp), ...]}
+messages = {}         # {username: [(is_sent, msg_text_or_lines, timestamp), ...]}
+current_username = None  # cached after login so the send path skips the dict lookup
 
 chat_messages_container = None  # assigned in chat_page()
+chat_scroll = None              # scroll area wrapping the rendered chat
+chat_column = None              # column holding the bubbles of the rendered chat
+top_spacer = None               # stands in for the rows above chat_window
+bottom_spacer = None            # stands in for the rows below chat_window
+rendered_chat = None            # chat currently drawn in chat_column
+rendered_msgs = []              # messages[rendered_chat]
+chat_window = [0, 0]            # [start, end) slice of rendered_msgs present in the DOM
+chat_at_bottom = True           # whether the user is scrolled to the latest message
+last_rendered_index = {}        # {username: number of messages already accounted for on screen}
+
+ROW_HEIGHT = 80                 # rough height of one chat bubble in px, maps scroll offsets to rows
+SIDEBAR_ROW_HEIGHT = 64
+SIDEBAR_VIRTUALIZE_AT = 50      # chat lists longer than this are windowed too
+RENDER_WINDOW = 60              # most rows kept in the DOM at once
+RENDER_BUFFER = 10              # rows rendered beyond each edge of the visible range
+
+chat_list_dirty = False         # chat_list has entries the sidebar has not drawn yet
+sidebar_column = None           # column holding the sidebar rows (unwindowed lists only)
+sidebar_rendered_ids = set()    # chat ids currently drawn in sidebar_column
+
+REFRESH_DEBOUNCE = 0.075        # seconds a burst must go quiet before the trailing render
+_refresh_pending = None         # (current_user, target_chat, msg_dict) awaiting render
+_refresh_timer = None
+_last_refresh = 0.0
 
 # Global variable for storing our nym address
 global_nym_address = None
@@ -47,37 +74,153 @@ def set_active_chat_user(value):
 def render_chat_messages(current_user, target_chat, msg_dict):
     """
     Refresh the chat area to display messages properly, inside a structured column.
+    Full re-render; used when switching chats. New messages go through render_new_messages.
+    Only a window of RENDER_WINDOW bubbles lives in the DOM; spacers stand in for the rest.
     """
+    global chat_scroll, chat_column, top_spacer, bottom_spacer, rendered_chat, rendered_msgs, chat_at_bottom
+
     # Ensure chat_messages_container is defined
     if chat_messages_container is not None:
         chat_messages_container.clear()  # Clear old messages before re-rendering
 
+    chat_column = None
+    rendered_chat = target_chat
     ui.label(f"Chat with {target_chat or ''}").classes('text-lg font-bold')
 
     if not target_chat or target_chat not in msg_dict or not msg_dict[target_chat]:
         ui.label('No messages yet.').classes('mx-auto my-4')
-    else:
-        with ui.column().classes('w-full max-w-6xl mx-auto items-stretch flex-grow gap-2'):
-            for sender_id, text, stamp in msg_dict[target_chat]:
-                is_sent = sender_id == current_user  # Check if the message is sent by the user
+        return
 
-                # Handle multi-line messages
-                text_content = text.split("\n") if "\n" in text else text
+    rendered_msgs = msg_dict[target_chat]
+    chat_at_bottom = True
+    with ui.scroll_area(on_scroll=on_chat_scroll).classes('w-full max-w-6xl mx-auto') \
+            .style('height: calc(100vh - 200px); scroll-behavior: auto') as chat_scroll:
+        top_spacer = ui.element('div')
+        chat_column = ui.column().classes('w-full items-stretch gap-2')
+        bottom_spacer = ui.element('div')
 
-                ui.chat_message(
-                    text=text_content,
-                    stamp=stamp,
-                    sent=is_sent
-                ).classes('p-3 rounded-lg')
+    total = len(rendered_msgs)
+    render_window(max(0, total - RENDER_WINDOW), total)
+    chat_scroll.scroll_to(percent=1.0)  # Auto-scroll to latest message
+
+def append_message(is_sent, text, stamp):
+    """
+    Build a single chat bubble at the end of the rendered chat column.
+    Multi-line text arrives already split into a list (see split_message_lines).
+    """
+    with chat_column:
+        ui.chat_message(
+            text=text,
+            stamp=stamp,
+            sent=is_sent
+        ).classes('p-3 rounded-lg')
+
+def render_window(start, end):
+    """Rebuild chat_column with only rendered_msgs[start:end], sizing the spacers for the rest."""
+    chat_column.clear()
+    for is_sent, text, stamp in rendered_msgs[start:end]:
+        append_message(is_sent, text, stamp)
+    chat_window[:] = [start, end]
+    top_spacer.style(f'height: {start * ROW_HEIGHT}px')
+    bottom_spacer.style(f'height: {(len(rendered_msgs) - end) * ROW_HEIGHT}px')
+    last_rendered_index[rendered_chat] = len(rendered_msgs)
+
+def window_for_scroll(e, row_height, current, total):
+    """
+    Map a scroll event to the (start, end) rows that should be in the DOM.
+    Returns None while `current` still covers the visible rows plus RENDER_BUFFER.
+    """
+    first = int(e.vertical_position // row_height)
+    last = first + int(e.vertical_container_size // row_height) + 1
+    start = max(0, first - RENDER_BUFFER)
+    end = min(total, last + RENDER_BUFFER)
+    if start >= current[0] and end <= current[1]:
+        return None
+    return start, min(total, max(end, start + RENDER_WINDOW))
+
+def on_chat_scroll(e):
+    global chat_at_bottom
+    if chat_column is None:
+        return
+    chat_at_bottom = e.vertical_position + e.vertical_container_size >= e.vertical_size - ROW_HEIGHT
+    window = window_for_scroll(e, ROW_HEIGHT, chat_window, len(rendered_msgs))
+    if window:
+        render_window(*window)
 
-    ui.run_javascript('window.scrollTo(0, document.body.scrollHeight)')  # Auto-scroll to latest message
+def render_new_messages(current_user, target_chat, msg_dict):
+    """
+    Append only the messages of target_chat that are not on screen yet.
+    Falls back to a full render if a different chat (or no column) is showing.
+    """
+    if chat_column is None or rendered_chat != target_chat or msg_dict.get(target_chat) is not rendered_msgs:
+        render_chat_messages.refresh(current_user, target_chat, msg_dict)
+        return
+
+    total = len(rendered_msgs)
+    start, end = chat_window
+    if end < last_rendered_index.get(target_chat, 0):
+        # Scrolled up into history: leave the window alone, just make room below it
+        bottom_spacer.style(f'height: {(total - end) * ROW_HEIGHT}px')
+        last_rendered_index[target_chat] = total
+        return
+
+    for is_sent, text, stamp in rendered_msgs[end:]:
+        append_message(is_sent, text, stamp)
+    while total - start > RENDER_WINDOW:
+        chat_column.remove(0)
+        start += 1
+    chat_window[:] = [start, total]
+    top_spacer.style(f'height: {start * ROW_HEIGHT}px')
+    last_rendered_index[target_chat] = total
+
+    # Follow new messages only if the user is reading the bottom of the chat
+    if chat_at_bottom:
+        chat_scroll.scroll_to(percent=1.0)
+
+def schedule_refresh(current_user, target_chat, msg_dict):
+    """
+    Debounced render_new_messages for bursty traffic. Renders straight away if the last
+    render was over 100ms ago, otherwise once the burst has been quiet for REFRESH_DEBOUNCE.
+    """
+    global _refresh_pending, _refresh_timer
+    _refresh_pending = (current_user, target_chat, msg_dict)
+    if _refresh_timer is not None:
+        return
+    if time.monotonic() - _last_refresh > 0.1:
+        do_refresh()
+    else:
+        _refresh_timer = asyncio.get_running_loop().call_later(REFRESH_DEBOUNCE, do_refresh)
+
+def do_refresh():
+    """Render whatever schedule_refresh last queued, unless the user has switched chats since."""
+    global _refresh_pending, _refresh_timer, _last_refresh
+    _refresh_timer = None
+    pending, _refresh_pending = _refresh_pending, None
+    if pending is None or pending[1] != active_chat:
+        return
+    _last_refresh = time.monotonic()
+    try:
+        render_new_messages(*pending)
+    except Exception as e:
+        logger.error(f"Failed to refresh chat UI: {e}")
 
 ###############################################################################
 # CREATE CORE OBJECTS
 ###############################################################################
-crypto_utils = CryptoUtils()
-connection_client = MixnetConnectionClient()
-message_handler = MessageHandler(crypto_utils, connection_client)
+# Built in init_services() once the server starts, so importing this module
+# (ui.run re-imports it for the reload watcher) does no setup work.
+crypto_utils = None
+connection_client = None
+message_handler = None
+
+@app.on_startup
+def init_services():
+    global crypto_utils, connection_client, message_handler
+    if message_handler is not None:
+        return
+    crypto_utils = CryptoUtils()
+    connection_client = MixnetConnectionClient()
+    message_handler = MessageHandler(crypto_utils, connection_client)
 
 ###############################################################################
 # UTILITY: SCAN FOR USERS, LOAD CHATS FROM DB, CONNECT TO MIXNET
@@ -89,13 +232,18 @@ def scan_for_users():
         logger.info("Created 'storage' directory for user data.")
         return
 
-    dirs = [
-        d for d in os.listdir(DB_DIR)
-        if os.path.isdir(os.path.join(DB_DIR, d))
-    ]
+    # The user list only changes when a user directory is added or removed
+    mtime = os.stat(DB_DIR).st_mtime
+    if _users_scan_cache.get(DB_DIR, (None,))[0] == mtime:
+        usernames = _users_scan_cache[DB_DIR][1]
+        return
+
+    with os.scandir(DB_DIR) as entries:
+        dirs = [entry.name for entry in entries if entry.is_dir(follow_symlinks=False)]
+    _users_scan_cache[DB_DIR] = (mtime, dirs)
     usernames = dirs
 
-def load_chats_from_db():
+async def load_chats_from_db():
     """Load the chat_list and messages from DB for the current user."""
     global chat_list, messages
     chat_list.clear()
@@ -106,27 +254,15 @@ def load_chats_from_db():
         logger.warning("DB manager not found; maybe not logged in yet.")
         return
 
-    rows = message_handler.db_manager.conn.execute(
-        f"SELECT DISTINCT username FROM messages_{active_username}"
-    ).fetchall()
-
-    # build chat_list
-    for (contact_username,) in rows:
+    # One query for every conversation, grouped per contact (rows are ordered by username)
+    rows = await message_handler.db_manager.get_all_messages_async(active_username)
+    for contact_username, chat_msgs in itertools.groupby(rows, key=operator.itemgetter(0)):
         chat_list.append({"id": contact_username, "name": contact_username})
 
-    # load messages
-    for info in chat_list:
-        contact_username = info["id"]
-        chat_msgs = message_handler.db_manager.get_messages_by_contact(
-            active_username, contact_username
-        )
-
-        msg_list = []
-        for (msg_type, msg_content, stamp) in chat_msgs:
-            sender_id = active_username if msg_type == 'to' else contact_username
-            msg_list.append((sender_id, msg_content, stamp))
-
-        messages[contact_username] = msg_list
+        messages[contact_username] = [
+            (msg_type == 'to', split_message_lines(msg_content), stamp)
+            for (_, msg_type, msg_content, stamp) in chat_msgs
+        ]
 
     logger.info("Chat list and messages loaded from DB.")
 
@@ -140,10 +276,17 @@ async def connect_mixnet():
     # Update MessageHandler with our nym address
     message_handler.update_nym_address(nym_address)
     logger.info(f"My Nym Address: {nym_address}")
+    def on_new_address(new_address):
+        # A replaced mixnet client is ephemeral, so it listens on a new address
+        global global_nym_address
+        global_nym_address = new_address
+        message_handler.update_nym_address(new_address)
+    connection_client.set_reconnect_callback(on_new_address)
     main_loop = asyncio.get_running_loop()
     def message_callback(msg):
         logger.debug(f"Received raw message from server: {msg}")
-        asyncio.run_coroutine_threadsafe(message_handler.handle_incoming_message(msg), main_loop)
+        main_loop.call_soon_threadsafe(message_handler.enqueue_incoming, msg)
+    asyncio.create_task(message_handler.process_incoming_queue())
     await connection_client.set_message_callback(message_callback)
     logger.info("Message callback set.")
     asyncio.create_task(connection_client.receive_messages())
@@ -159,19 +302,32 @@ async def send_message(text_input):
 
     msg_text = text_input.value.strip()
     text_input.value = ''
-    current_user = message_handler.current_user["username"]
-
-    # 1) Send direct message
-    await message_handler.send_direct_message(active_chat_user, msg_text)
-
-    # 2) Store in local memory
-    stamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    if active_chat not in messages:
-        messages[active_chat] = []
-    messages[active_chat].append((current_user, msg_text, stamp))
-
-    # 3) Re-render chat UI
-    render_chat_messages.refresh(current_user, active_chat, messages)
+    # Bind the globals once; the callback below reuses them
+    chat = active_chat
+    recipient = active_chat_user
+    user = current_username
+    msgs = messages
+    mh = message_handler
+
+    # 1) Store in local memory and re-render right away (optimistic)
+    stamp = message_timestamp()
+    chat_msgs = msgs.setdefault(chat, [])
+    text_content = split_message_lines(msg_text)
+    entry = (True, text_content, stamp)
+    chat_msgs.append(entry)
+    schedule_refresh(user, chat, msgs)
+
+    # 2) Send in the background, in input order; if it fails, mark the message and repaint
+    def on_sent(sent):
+        if sent.cancelled() or sent.exception() is None:
+            return
+        logger.error(f"Failed to send message to {recipient}: {sent.exception()}")
+        if entry in chat_msgs:
+            chat_msgs[chat_msgs.index(entry)] = (True, text_content, f"{stamp} - failed to send")
+            if active_chat == chat:
+                render_chat_messages.refresh(user, chat, msgs)
+
+    mh.queue_direct_message(recipient, msg_text).add_done_callback(on_sent)
 
 async def send_handshake():
     """
@@ -225,13 +381,16 @@ def login_page():
                     return
                 spin.props(remove='hidden')  # Show spinner
 
+                global current_username
+
                 # Begin login process
                 await message_handler.login_user(user_select.value)
                 await message_handler.login_complete.wait()
+                current_username = message_handler.current_user["username"]
 
                 # Set up UI state and load chat data
-                message_handler.set_ui_state(messages, chat_list, get_active_chat, render_chat_messages, chat_messages_container)
-                load_chats_from_db()
+                message_handler.set_ui_state(messages, chat_list, get_active_chat, schedule_refresh, chat_messages_container)
+                await load_chats_from_db()
 
                 spin.props('hidden')  # Hide spinner
 
@@ -294,17 +453,70 @@ def chat_page():
     message_handler.new_message_callback = show_new_message_notification
 
 
+    def chat_row(info):
+        sidebar_rendered_ids.add(info["id"])
+        with ui.row().classes('p-2 hover:bg-gray-800 cursor-pointer') \
+                .on('click', lambda _, u=info: open_chat(u)):
+            ui.label(info["name"]).classes('font-bold text-white')
+            ui.label('Click to open chat').classes('text-gray-400 text-sm')
+
     @ui.refreshable
     def chat_list_sidebar():
-        with ui.column():
+        global sidebar_column
+        sidebar_column = None
+        sidebar_rendered_ids.clear()
+        with ui.column() as column:
             ui.label('Chats').classes('text-xl font-bold')
             if not chat_list:
                 ui.label('No chats yet').classes('text-gray-400')
+            if len(chat_list) <= SIDEBAR_VIRTUALIZE_AT:
+                sidebar_column = column
+                for info in chat_list:
+                    chat_row(info)
+                return
+
+            # Long chat lists only keep the rows around the visible range in the DOM
+            sidebar_window = [0, 0]
+
+            def render_rows(start, end):
+                rows.clear()
+                with rows:
+                    for info in chat_list[start:end]:
+                        chat_row(info)
+                sidebar_window[:] = [start, end]
+                top.style(f'height: {start * SIDEBAR_ROW_HEIGHT}px')
+                bottom.style(f'height: {(len(chat_list) - end) * SIDEBAR_ROW_HEIGHT}px')
+
+            def on_scroll(e):
+                window = window_for_scroll(e, SIDEBAR_ROW_HEIGHT, sidebar_window, len(chat_list))
+                if window:
+                    render_rows(*window)
+
+            with ui.scroll_area(on_scroll=on_scroll).classes('w-full').style('height: calc(100vh - 120px)'):
+                top = ui.element('div')
+                rows = ui.column()
+                bottom = ui.element('div')
+            render_rows(0, min(len(chat_list), RENDER_WINDOW))
+
+    def mark_sidebar_dirty():
+        """Called for each new chat; one flush_sidebar 100ms later draws them all."""
+        global chat_list_dirty
+        if chat_list_dirty:
+            return
+        chat_list_dirty = True
+        asyncio.get_running_loop().call_later(0.1, flush_sidebar)
+
+    def flush_sidebar():
+        """Append rows only for chats missing from the sidebar instead of rebuilding it."""
+        global chat_list_dirty
+        chat_list_dirty = False
+        if sidebar_column is None or not sidebar_rendered_ids or len(chat_list) > SIDEBAR_VIRTUALIZE_AT:
+            chat_list_sidebar.refresh()
+            return
+        with sidebar_column:
             for info in chat_list:
-                with ui.row().classes('p-2 hover:bg-gray-800 cursor-pointer') \
-                        .on('click', lambda _, u=info: open_chat(u)):
-                    ui.label(info["name"]).classes('font-bold text-white')
-                    ui.label('Click to open chat').classes('text-gray-400 text-sm')
+                if info["id"] not in sidebar_rendered_ids:
+                    chat_row(info)
 
     def open_chat(u):
         set_active_chat(u["id"])
@@ -330,7 +542,7 @@ def chat_page():
             ui.element('q-fab-action').props('icon=power_settings_new color=green-6 label=SHUTDOWN') \
                 .on('click', lambda: (app.shutdown(), ui.notify("Shutting down the app...")))
 
-    message_handler.set_ui_state(messages, chat_list, get_active_chat, render_chat_messages, chat_messages_container, chat_list_sidebar)
+    message_handler.set_ui_state(messages, chat_list, get_active_chat, schedule_refresh, chat_messages_container, mark_sidebar_dirty)
     render_chat_messages(user_id, active_chat, messages)
 
     with ui.footer().classes('w-full bg-zinc-800 text-white p-4'):
@@ -398,21 +610,16 @@ async def startup_sequence():
         messages,               # in-memory messages dict
         chat_list,              # in-memory chat_list
         get_active_chat,        # function to retrieve 'active_chat'
-        render_chat_messages,   # our refreshable function
+        schedule_refresh,       # debounced append of new messages to the chat UI
         chat_messages_container # container (if needed)
     )
 
-def shutdown_client():
-    # Create a new event loop in this thread and run the shutdown coroutine
-    asyncio.run(connection_client.shutdown())
-
 @app.on_shutdown
-def on_shutdown():
-    if connection_client.client is not None:
+async def on_shutdown():
+    if connection_client is not None and connection_client.client is not None:
         logger.info("Shutting down Mixnet client...")
-        t = threading.Thread(target=shutdown_client)
-        t.start()
-        t.join()  # Wait for shutdown to complete
+        # Runs on the main loop, where the send queue and writer task live, so queued messages get flushed
+        await connection_client.shutdown()
         logger.info("Mixnet client shutdown complete.")
         
 ui.run(dark=True, host='0.0.0.0', title="NymCHAT")
@@ -0,0 +1,124 @@
+import unittest
+import asyncio
+from unittest.mock import patch
+import connectionUtils
+from connectionUtils import MixnetConnectionClient
+
+class FakeMixnetClient:
+    """Stands in for PyMixnetClient; fails the first `failures` sends."""
+    created = []
+    next_failures = 0  # failures given to the next client create() builds
+
+    def __init__(self, failures=0):
+        self.address = f"addr-{len(FakeMixnetClient.created)}"
+        self.failures = failures
+        self.sent = []
+        self.receiving = False
+        self.shut_down = False
+        FakeMixnetClient.created.append(self)
+
+    @classmethod
+    async def create(cls):
+        return cls(failures=cls.next_failures)
+
+    async def get_nym_address(self):
+        return self.address
+
+    async def send_message(self, recipient, message):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("Failed to send message: gateway hiccup")
+        self.sent.append((recipient, message))
+
+    async def set_message_callback(self, callback):
+        pass
+
+    async def receive_messages(self):
+        self.receiving = True
+
+    async def shutdown(self):
+        self.shut_down = True
+
+class TestMixnetConnectionClient(unittest.TestCase):
+    def setUp(self):
+        FakeMixnetClient.created = []
+        FakeMixnetClient.next_failures = 0
+        patcher = patch.object(connectionUtils, "PyMixnetClient", FakeMixnetClient)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        delay = patch.object(connectionUtils, "RETRY_DELAY", 0)
+        delay.start()
+        self.addCleanup(delay.stop)
+
+    def test_transient_failure_retries_same_client(self):
+        async def run():
+            FakeMixnetClient.next_failures = connectionUtils.CALL_RETRIES - 1
+            client = MixnetConnectionClient()
+            await client.init()
+            await client.receive_messages()
+            await client._call("send_message", "bob", "hi")
+            return client
+
+        client = asyncio.run(run())
+        self.assertEqual(len(FakeMixnetClient.created), 1)
+        self.assertEqual(client.client.sent, [("bob", "hi")])
+
+    def test_dead_client_is_replaced(self):
+        async def run():
+            FakeMixnetClient.next_failures = connectionUtils.CALL_RETRIES
+            addresses = []
+            client = MixnetConnectionClient()
+            client.set_reconnect_callback(addresses.append)
+            await client.init()
+            await client.receive_messages()
+            FakeMixnetClient.next_failures = 0
+            await client._call("send_message", "bob", "hi")
+            return client, addresses
+
+        client, addresses = asyncio.run(run())
+        old, new = FakeMixnetClient.created
+        self.assertTrue(old.shut_down)
+        self.assertTrue(new.receiving)
+        self.assertEqual(new.sent, [("bob", "hi")])
+        self.assertEqual(addresses, [new.address])
+
+    def test_send_message_waits_for_the_send(self):
+        async def run():
+            client = MixnetConnectionClient()
+            await client.init()
+            await asyncio.gather(
+                client.send_message({"recipient": "bob", "message": "one"}),
+                client.send_message({"recipient": "bob", "message": "two"}),
+            )
+            return client
+
+        client = asyncio.run(run())
+        # Both were queued before the writer woke, so they share one batch frame
+        self.assertEqual(client.client.sent, [("bob", '{"batch":["one","two"]}')])
+
+    def test_send_message_raises_when_the_send_fails(self):
+        async def run():
+            FakeMixnetClient.next_failures = 100
+            client = MixnetConnectionClient()
+            await client.init()
+            await client.send_message({"recipient": "bob", "message": "hi"})
+
+        with self.assertRaises(RuntimeError):
+            asyncio.run(run())
+
+    def test_shutdown_flushes_queued_messages(self):
+        async def run():
+            client = MixnetConnectionClient()
+            await client.init()
+            pending = asyncio.create_task(client.send_message({"recipient": "bob", "message": "bye"}))
+            await asyncio.sleep(0)  # let it reach the queue
+            await client.shutdown()
+            await pending
+            return client
+
+        client = asyncio.run(run())
+        self.assertEqual(client.client.sent, [("bob", "bye")])
+        self.assertTrue(client.client.shut_down)
+
+if __name__ == "__main__":
+    unittest.main()
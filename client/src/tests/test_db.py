@@ -1,5 +1,6 @@
 import unittest
 import os
+import asyncio
 from dbUtils import SQLiteManager  # Assuming the class is in a file named sqlite_manager.py
 
 class TestSQLiteManager(unittest.TestCase):
@@ -55,6 +56,11 @@ class TestSQLiteManager(unittest.TestCase):
         self.assertEqual(len(messages), 1)
         self.assertEqual(messages[0][1], "Hey Dave!")
 
+    def test_save_messages(self):
+        self.db_manager.save_messages(self.username, [("dave", "from", "One"), ("dave", "to", "Two")])
+        messages = self.db_manager.get_messages_by_contact(self.username, "dave")
+        self.assertEqual([(m[0], m[1]) for m in messages], [("from", "One"), ("to", "Two")])
+
     def test_get_all_messages(self):
         messages = self.db_manager.get_all_messages(self.username)
         self.assertGreater(len(messages), 1)
@@ -69,6 +75,29 @@ class TestSQLiteManager(unittest.TestCase):
         messages = self.db_manager.get_all_messages(self.username)
         self.assertEqual(len(messages), 0)
 
+    def test_async_read_and_write(self):
+        async def run():
+            await self.db_manager.write(self.db_manager.save_message, self.username, "alice", "from", "Hi!")
+            return await self.db_manager.get_messages_by_contact_async(self.username, "alice")
+
+        messages = asyncio.run(run())
+        self.assertEqual([m[1] for m in messages], ["Hello Alice!", "Hi!"])
+
+    def test_async_contact_write_and_read(self):
+        async def run():
+            await self.db_manager.write(self.db_manager.add_contact, self.username, "erin", "public_key_erin")
+            return await self.db_manager.get_contact_async(self.username, "erin")
+
+        self.assertEqual(asyncio.run(run()), ("erin", "public_key_erin"))
+
+    def test_invalid_table_username(self):
+        with self.assertRaises(ValueError):
+            self.db_manager.get_all_contacts("alice; DROP TABLE users")
+
+    def test_journal_mode_is_wal(self):
+        mode = self.db_manager.conn.execute("PRAGMA journal_mode").fetchone()[0]
+        self.assertEqual(mode, "wal")
+
     def test_get_all_users(self):
         users = self.db_manager.get_all_users()
         self.assertIn((self.username, "public_key_testuser"), users)
@@ -4,7 +4,7 @@ import os
 import secrets
 import asyncio
 from cryptography.hazmat.primitives import serialization
-from messageHandler import MessageHandler
+from messageHandler import MessageHandler, message_timestamp
 from cryptographyUtils import CryptoUtils
 from dbUtils import SQLiteManager
 from connectionUtils import MixnetConnectionClient
@@ -251,13 +251,10 @@ class TestMessageHandler(unittest.TestCase):
         # print(f"[TEST] Send response: {server_response}")
         self.assertIn("success", server_response)
 
-    def test_handle_incoming_message(self):
-        asyncio.run(self.async_test_handle_incoming_message())
-
-    async def async_test_handle_incoming_message(self):
+    def _build_incoming_message(self, message_content):
+        """Encrypt, sign and encapsulate a chat message from friend to testuser."""
         sender = self.friend_username
         recipient = self.username
-        message_content = "Hello!"
 
         # ✅ Ensure message format matches original encapsulation
         wrapped_message = json.dumps({"type": 0, "message": message_content})
@@ -288,13 +285,64 @@ class TestMessageHandler(unittest.TestCase):
         outer_signature = self.crypto_utils.sign_message(sender_private_key, payload_str)
 
         # ✅ Construct final incoming message
-        incoming_message = json.dumps({
+        return json.dumps({
             "action": "incomingMessage",
             "context": "chat",
             "content": payload,
             "signature": outer_signature
         })
 
+    def test_queued_direct_messages_keep_input_order(self):
+        asyncio.run(self.async_test_queued_direct_messages_keep_input_order())
+
+    async def async_test_queued_direct_messages_keep_input_order(self):
+        class RecordingConnection:
+            def __init__(self):
+                self.wire = []
+
+            async def enqueue_message(self, message):
+                self.wire.append(message["message"])
+                sent = asyncio.get_running_loop().create_future()
+                sent.set_result(None)
+                return sent
+
+        connection = RecordingConnection()
+        self.message_handler.connection_client = connection
+        texts = ["first", "second", "third"]
+        done = [self.message_handler.queue_direct_message(self.friend_username, text) for text in texts]
+        await asyncio.gather(*done)
+
+        # Decrypt what went on the wire, as the friend would
+        friend_key = self.crypto_utils.load_private_key(self.friend_username)
+        wire_texts = []
+        for frame in connection.wire:
+            payload = json.loads(json.loads(frame)["content"])
+            decrypted = self.crypto_utils.decrypt_message(friend_key, payload["body"]["encryptedPayload"])
+            wire_texts.append(json.loads(decrypted)["message"])
+        self.assertEqual(wire_texts, texts)
+
+        stored = self.db_manager.get_messages_by_contact(self.username, self.friend_username)
+        self.assertEqual([m[1] for m in stored], texts)
+
+    def test_queued_direct_message_without_contact_fails(self):
+        asyncio.run(self.async_test_queued_direct_message_without_contact_fails())
+
+    async def async_test_queued_direct_message_without_contact_fails(self):
+        with self.assertRaises(RuntimeError):
+            await self.message_handler.queue_direct_message("nobody", "Hello?")
+        self.assertEqual(self.db_manager.get_messages_by_contact(self.username, "nobody"), [])
+
+    def test_message_timestamp_format(self):
+        self.assertRegex(message_timestamp(), r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$")
+
+    def test_handle_incoming_message(self):
+        asyncio.run(self.async_test_handle_incoming_message())
+
+    async def async_test_handle_incoming_message(self):
+        sender = self.friend_username
+        recipient = self.username
+        incoming_message = self._build_incoming_message("Hello!")
+
         # print(f"simulating incoming message: {incoming_message}")
 
         # ✅ Process the incoming message
@@ -307,6 +355,69 @@ class TestMessageHandler(unittest.TestCase):
         chat_messages = self.db_manager.get_messages_by_contact(recipient, sender)
         self.assertGreater(len(chat_messages), 0)
 
+    def test_handle_batched_incoming_message(self):
+        asyncio.run(self.async_test_handle_batched_incoming_message())
+
+    async def async_test_handle_batched_incoming_message(self):
+        batch = json.dumps({"batch": [
+            self._build_incoming_message("First"),
+            self._build_incoming_message("Second"),
+        ]})
+
+        await self.message_handler.handle_incoming_message(batch)
+
+        chat_messages = self.db_manager.get_messages_by_contact(self.username, self.friend_username)
+        self.assertEqual([m[1] for m in chat_messages], ["First", "Second"])
+
+    def test_handle_incoming_batch(self):
+        asyncio.run(self.async_test_handle_incoming_batch())
+
+    async def async_test_handle_incoming_batch(self):
+        batch = [
+            self._build_incoming_message("One"),
+            "not json",
+            self._build_incoming_message("Two"),
+        ]
+
+        await self.message_handler.handle_incoming_batch(batch)
+
+        chat_messages = self.db_manager.get_messages_by_contact(self.username, self.friend_username)
+        self.assertEqual([m[1] for m in chat_messages], ["One", "Two"])
+
+    def test_failed_batch_store_does_not_stop_consumer(self):
+        asyncio.run(self.async_test_failed_batch_store_does_not_stop_consumer())
+
+    async def async_test_failed_batch_store_does_not_stop_consumer(self):
+        def locked(*args, **kwargs):
+            raise RuntimeError("database is locked")
+        self.db_manager.save_messages = locked
+        # The handler itself failing must not end the consumer either
+        handle_batch = self.message_handler.handle_incoming_batch
+        calls = []
+        async def flaky_handle_batch(batch):
+            calls.append(batch)
+            if len(calls) == 1:
+                raise RuntimeError("boom")
+            await handle_batch(batch)
+        self.message_handler.handle_incoming_batch = flaky_handle_batch
+
+        consumer = asyncio.create_task(self.message_handler.process_incoming_queue())
+        try:
+            self.message_handler.enqueue_incoming(self._build_incoming_message("Lost"))
+            await asyncio.sleep(0.1)
+            self.message_handler.enqueue_incoming(self._build_incoming_message("Later"))
+            for _ in range(50):
+                if self.db_manager.get_messages_by_contact(self.username, self.friend_username):
+                    break
+                await asyncio.sleep(0.05)
+            self.assertFalse(consumer.done())
+        finally:
+            consumer.cancel()
+
+        # The batch insert failed, so the row was stored on its own instead
+        chat_messages = self.db_manager.get_messages_by_contact(self.username, self.friend_username)
+        self.assertEqual([m[1] for m in chat_messages], ["Later"])
+
         
 if __name__ == "__main__":
     unittest.main()
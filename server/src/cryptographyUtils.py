@@ -1,22 +1,26 @@
 import os
 import base64
 import secrets
+from binascii import unhexlify
+from functools import lru_cache
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives.asymmetric import ec
-from cryptography.hazmat.primitives.asymmetric.utils import encode_dss_signature, decode_dss_signature
 from logConfig import logger
-from envLoader import load_env
 
-load_env()
+@lru_cache(maxsize=1024)
+def _load_public_key_pem(publicKeyPem):
+    """Parse a PEM public key once; users' keys are verified against over and over."""
+    return serialization.load_pem_public_key(publicKeyPem.encode())
 
 class CryptoUtils:
     def __init__(self, key_dir, password):
         """Initialize the CryptoUtils with a directory for storing keys and a password for encryption."""
         self.key_dir = os.getenv("KEYS_DIR", "storage/keys")
         self.password = password  # Store password in memory
+        self._private_keys = {}  # username -> decrypted key; decrypting runs 100k PBKDF2 rounds
         if not os.path.exists(self.key_dir):
             os.makedirs(self.key_dir)
 
@@ -62,6 +66,7 @@ class CryptoUtils:
         )
 
         encrypted_private_key = self._encrypt_private_key(private_key_pem)
+        self._private_keys[username] = private_key
 
         private_key_path = os.path.join(self.key_dir, f"{username}_private_key.enc")
         public_key_path = os.path.join(self.key_dir, f"{username}_public_key.pem")
@@ -84,7 +89,11 @@ class CryptoUtils:
         ).decode()
 
     def load_private_key(self, username):
-        """Load and decrypt the private key from storage."""
+        """Load and decrypt the private key from storage (once; later calls hit the cache)."""
+        private_key = self._private_keys.get(username)
+        if private_key is not None:
+            return private_key
+
         private_key_path = os.path.join(self.key_dir, f"{username}_private_key.enc")
 
         if not os.path.exists(private_key_path):
@@ -96,6 +105,7 @@ class CryptoUtils:
         try:
             decrypted_pem = self._decrypt_private_key(encrypted_data)
             private_key = serialization.load_pem_private_key(decrypted_pem, password=None, backend=default_backend())
+            self._private_keys[username] = private_key
             return private_key
         except Exception as e:
             logger.error(f"loadPrivateKey - error :( |{e}")
@@ -123,9 +133,8 @@ class CryptoUtils:
                 message.encode(),
                 ec.ECDSA(hashes.SHA256())
             )
-            r, s = decode_dss_signature(signature)
-            logger.info(f"signMessage - success!")
-            return encode_dss_signature(r, s).hex()
+            logger.debug("signMessage - success!")
+            return signature.hex()
         except Exception as e:
             logger.error(f"signMessage - error :( | {e}")
             return None
@@ -133,14 +142,13 @@ class CryptoUtils:
     def verify_signature(self, publicKeyPem, message, signature):
         """Verify a message signature using the provided public key in PEM format."""
         try:
-            public_key = serialization.load_pem_public_key(publicKeyPem.encode())
-            r, s = decode_dss_signature(bytes.fromhex(signature))
+            public_key = _load_public_key_pem(publicKeyPem)
             public_key.verify(
-                encode_dss_signature(r, s),
+                unhexlify(signature),
                 message.encode(),
                 ec.ECDSA(hashes.SHA256())
             )
-            logger.info("verifySignature - success!")
+            logger.debug("verifySignature - success!")
             return True
         except Exception as e:
             logger.error(f"verifySignature - error :( | {e}")
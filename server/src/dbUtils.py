@@ -1,89 +1,200 @@
 import sqlite3
-import json
+import orjson
 import os
+import asyncio
+import threading
+from collections import OrderedDict
 from logConfig import logger
-from envLoader import load_env
 
-load_env()
+# Fixed statement text, so sqlite3's per-connection statement cache can reuse the prepared statements
+INSERT_USER_SQL = "INSERT INTO users (username, publicKey, senderTag) VALUES (?, ?, ?)"
+GET_USER_BY_USERNAME_SQL = "SELECT username, publicKey, senderTag FROM users WHERE username = ?"
+GET_USER_BY_SENDER_TAG_SQL = "SELECT username, publicKey, senderTag FROM users WHERE senderTag = ?"
+INSERT_GROUP_SQL = "INSERT INTO groups (groupID, userList) VALUES (?, ?)"
+GET_GROUP_SQL = "SELECT groupID, userList FROM groups WHERE groupID = ?"
+
+# One UPDATE per column that may be changed; anything else is rejected
+UPDATE_USER_FIELD_SQL = {
+    "username": "UPDATE users SET username = ? WHERE username = ?",
+    "publicKey": "UPDATE users SET publicKey = ? WHERE username = ?",
+    "senderTag": "UPDATE users SET senderTag = ? WHERE username = ?",
+}
+
+USER_CACHE_SIZE = 1024  # most recently used user rows kept per lookup key
 
 class DbUtils:
     def __init__(self, dbPath):
         self.dbPath = os.getenv("DATABASE_PATH")
 
-        if not os.path.exists(dbPath):
-            logger.info(f"Initializing new database at {dbPath}.")
+        # An empty file (e.g. touched by a mount) has no schema either
+        new_db = not os.path.exists(dbPath) or os.path.getsize(dbPath) == 0
+        if new_db:
+            logger.info("Initializing new database at %s.", dbPath)
         else:
-            logger.info(f"Using existing database at {dbPath}.")
+            logger.info("Using existing database at %s.", dbPath)
+
+        self._path = dbPath
+        self._local = threading.local()  # one connection per thread: the event loop and the write worker
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._write_lock = asyncio.Lock()  # One write at a time on the worker thread
+        # LRU caches of user rows by username and by senderTag; writes run on worker threads, hence the lock
+        self._user_cache = OrderedDict()
+        self._tag_cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._cache_generation = 0  # bumped on every invalidation, so a lookup racing a write doesn't cache its row
+        if new_db:
+            self._initializeTables()
+        self._migrate()
 
-        self.connection = sqlite3.connect(dbPath, check_same_thread=False)
-        self.cursor = self.connection.cursor()
-        self._initializeTables()
+    def _conn(self):
+        """Return this thread's connection, opening it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Only this thread uses it; check_same_thread=False is just so close() can shut it from the loop thread
+            conn = sqlite3.connect(self._path, check_same_thread=False, cached_statements=256)
+            # WAL + NORMAL sync: commits during registration bursts skip the per-commit fsync of the main file
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            conn.execute("PRAGMA cache_size=-65536")  # 64 MiB page cache
+            conn.execute("PRAGMA mmap_size=268435456")  # read pages through a 256 MiB mapping
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
 
     def _initializeTables(self):
-        logger.info("Ensuring necessary database tables exist...")
-        self.cursor.execute("""
+        """Create the tables; only needed when the database file is new."""
+        logger.info("Creating database tables...")
+        conn = self._conn()
+        conn.execute("""
         CREATE TABLE IF NOT EXISTS users (
             username TEXT PRIMARY KEY,
             publicKey TEXT NOT NULL,
             senderTag TEXT NOT NULL
         )
         """)
-        self.cursor.execute("""
+        conn.execute("""
         CREATE TABLE IF NOT EXISTS groups (
             groupID TEXT PRIMARY KEY,
             userList TEXT NOT NULL
         )
         """)
-        self.connection.commit()
+        conn.commit()
+
+    def _migrate(self):
+        """Idempotent settings and indexes applied on every start, so existing databases pick them up."""
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")  # persistent; lets reads run alongside the writer
+        # Sender tags are looked up on every query/send, and only username is a key
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_users_senderTag ON users(senderTag)")
+        conn.commit()
+
+    async def write(self, method, *args, **kwargs):
+        """
+        Run a write method (addUser, updateUserField, addGroup) in a worker thread so the
+        commit doesn't block the event loop.
+        """
+        async with self._write_lock:
+            return await asyncio.to_thread(method, *args, **kwargs)
 
     def addUser(self, username, publicKey, senderTag):
+        conn = self._conn()
         try:
-            self.cursor.execute(
-                "INSERT INTO users (username, publicKey, senderTag) VALUES (?, ?, ?)",
-                (username, publicKey, senderTag),
-            )
-            self.connection.commit()
-            logger.info(f"User {username} added successfully.")
+            conn.execute(INSERT_USER_SQL, (username, publicKey, senderTag))
+            conn.commit()
+            self._invalidateUser(username)
+            logger.info("User %s added successfully.", username)
         except sqlite3.IntegrityError as e:
-            logger.error(f"Error adding user {username}: {e}")
+            conn.rollback()  # release the write lock held by the failed statement
+            logger.error("Error adding user %s: %s", username, e)
             return False
         return True
 
+    def _cacheGet(self, cache, key):
+        """Return the cached row for key (marking it recently used), or None."""
+        with self._cache_lock:
+            row = cache.get(key)
+            if row is not None:
+                cache.move_to_end(key)
+            return row
+
+    def _cachedLookup(self, cache, key, sql):
+        """Return the user row for key from cache, querying (and caching hits) on a miss."""
+        row = self._cacheGet(cache, key)
+        if row is not None:
+            return row
+        generation = self._cache_generation
+        row = self._conn().execute(sql, (key,)).fetchone()
+        if row is not None:
+            with self._cache_lock:
+                if generation != self._cache_generation:
+                    return row  # a write landed while we queried; the row may already be stale
+                cache[key] = row
+                if len(cache) > USER_CACHE_SIZE:
+                    cache.popitem(last=False)
+        return row
+
+    def _invalidateUser(self, username):
+        """Drop every cached row for username; called after any write to that user."""
+        with self._cache_lock:
+            self._cache_generation += 1
+            self._user_cache.pop(username, None)
+            for tag in [tag for tag, row in self._tag_cache.items() if row[0] == username]:
+                del self._tag_cache[tag]
+
     def getUserByUsername(self, username):
-        self.cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
-        return self.cursor.fetchone()
+        return self._cachedLookup(self._user_cache, username, GET_USER_BY_USERNAME_SQL)
 
     def getUserBySenderTag(self, senderTag):
-        self.cursor.execute("SELECT * FROM users WHERE senderTag = ?", (senderTag,))
-        return self.cursor.fetchone()
+        return self._cachedLookup(self._tag_cache, senderTag, GET_USER_BY_SENDER_TAG_SQL)
+
+    async def fetchUserByUsername(self, username):
+        """
+        getUserByUsername for the event loop: a cached row is returned directly,
+        a miss is queried on a worker thread (with its own connection).
+        """
+        row = self._cacheGet(self._user_cache, username)
+        if row is None:
+            row = await asyncio.to_thread(self.getUserByUsername, username)
+        return row
 
     def updateUserField(self, username, field, value):
+        sql = UPDATE_USER_FIELD_SQL.get(field)
+        if sql is None:
+            logger.error("Refusing to update unknown user field %s", field)
+            return False
+        conn = self._conn()
         try:
-            self.cursor.execute(f"UPDATE users SET {field} = ? WHERE username = ?", (value, username))
-            self.connection.commit()
-            logger.info(f"User {username} field {field} updated")
+            conn.execute(sql, (value, username))
+            conn.commit()
+            self._invalidateUser(username)
+            logger.info("User %s field %s updated", username, field)
             return True
         except sqlite3.Error as e:
-            logger.error(f"Error updating user {username} field {field}: {e}")
+            conn.rollback()  # release the write lock held by the failed statement
+            logger.error("Error updating user %s field %s: %s", username, field, e)
             return False
 
     def addGroup(self, groupId, initialUsers):
+        conn = self._conn()
         try:
-            self.cursor.execute(
-                "INSERT INTO groups (groupID, userList) VALUES (?, ?)",
-                (groupId, json.dumps(initialUsers)),
-            )
-            self.connection.commit()
-            logger.info(f"Group {groupId} added successfully.")
+            conn.execute(INSERT_GROUP_SQL, (groupId, orjson.dumps(initialUsers).decode()))
+            conn.commit()
+            logger.info("Group %s added successfully.", groupId)
         except sqlite3.IntegrityError as e:
-            logger.error(f"Error adding group {groupId}: {e}")
+            conn.rollback()  # release the write lock held by the failed statement
+            logger.error("Error adding group %s: %s", groupId, e)
             return False
         return True
 
     def getGroup(self, groupId):
-        self.cursor.execute("SELECT * FROM groups WHERE groupID = ?", (groupId,))
-        return self.cursor.fetchone()
+        return self._conn().execute(GET_GROUP_SQL, (groupId,)).fetchone()
 
     def close(self):
         logger.info("Closing database connection.")
-        self.connection.close()
\ No newline at end of file
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
\ No newline at end of file
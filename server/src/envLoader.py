@@ -1,11 +1,15 @@
 import os
 
 def load_env(filepath=".env"):
-    """Load environment variables from a .env file into os.environ."""
-    if os.path.exists(filepath):
-        with open(filepath) as f:
+    """Load environment variables from a .env file into os.environ (once per process tree)."""
+    path = os.path.abspath(filepath)
+    if os.environ.get("_ENV_LOADED") == path:
+        return
+    if os.path.exists(path):
+        with open(path) as f:
             for line in f:
                 # Ignore empty lines and comments
                 if line.strip() and not line.startswith("#"):
                     key, value = line.strip().split("=", 1)
                     os.environ[key] = value
+        os.environ["_ENV_LOADED"] = path
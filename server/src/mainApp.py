@@ -2,6 +2,7 @@ import asyncio
 import os
 import sys
 import time
+import select
 import signal
 import subprocess
 import threading
@@ -12,98 +13,131 @@ from cryptographyUtils import CryptoUtils
 from logConfig import logger
 from envLoader import load_env
 
+try:
+    import uvloop  # libuv-backed event loop; optional, the stdlib loop is used without it
+except ImportError:
+    uvloop = None
+
 load_env()
 
+# Resolved once after load_env(); nothing below reads the environment again
+NYM_CLIENT_ID = os.getenv("NYM_CLIENT_ID")
+KEYS_DIR = os.getenv("KEYS_DIR", "storage/keys")
+DATABASE_PATH = os.getenv("DATABASE_PATH", "storage/nym_server.db")
+SECRET_PATH = os.getenv("SECRET_PATH")
+WEBSOCKET_URL = os.getenv("WEBSOCKET_URL")
+LOG_FILE = os.getenv("LOG_FILE", "storage/app.log")
+
 # Ensure all required directories exist
 storage_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "storage")
 os.makedirs(storage_dir, exist_ok=True)
-keys_dir = os.getenv("KEYS_DIR", "storage/keys")
-os.makedirs(keys_dir, exist_ok=True)
-logs_dir = os.path.dirname(os.getenv("LOG_FILE", "storage/app.log"))
+os.makedirs(KEYS_DIR, exist_ok=True)
+logs_dir = os.path.dirname(LOG_FILE)
 os.makedirs(logs_dir, exist_ok=True)
 
 # Global variables
 client_process = None
 shutdown_event = threading.Event()  # Used for clean shutdown
+stop_event = None  # asyncio.Event that main() waits on; created once the loop is running
+main_loop = None
 
 
 def get_encryption_password():
-    secret_path = os.getenv("SECRET_PATH")
-    if os.path.exists(secret_path):
-        with open(secret_path, "r") as f:
+    if os.path.exists(SECRET_PATH):
+        with open(SECRET_PATH, "r") as f:
             return f.read().strip()
     logger.error("Encryption password secret not found.")
     sys.exit(1)
 
 def initialize_nym_client():
     """Checks if Nym client is already initialized, and initializes if necessary."""
-    nym_client_id = os.getenv("NYM_CLIENT_ID")
-    nym_client_dir = f"/root/.nym/clients/{nym_client_id}"
+    nym_client_dir = f"/root/.nym/clients/{NYM_CLIENT_ID}"
 
     if os.path.exists(nym_client_dir):
         logger.info("Existing Nym config found. Skipping init.")
     else:
         logger.info("No existing Nym config found. Initializing...")
-        command = ["./nym-client", "init", "--id", nym_client_id]
+        command = ["./nym-client", "init", "--id", NYM_CLIENT_ID]
         try:
             subprocess.run(command, check=True)
             logger.info("Nym client initialized successfully.")
         except subprocess.CalledProcessError as e:
-            logger.error(f"Failed to initialize Nym client: {e}")
+            logger.error("Failed to initialize Nym client: %s", e)
             sys.exit(1)
 
 def start_client():
     """Starts the `nym-client` process without using a shell."""
     global client_process
     try:
-        command = ["./nym-client", "run", "--id", os.getenv("NYM_CLIENT_ID")]
-        client_process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        command = ["./nym-client", "run", "--id", NYM_CLIENT_ID]
+        # Own process group, so shutdown can signal the client and anything it spawned in one call
+        client_process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
         logger.info("Nym client started successfully.")
 
         # Wait for the client to initialize
         time.sleep(5)  # Allow the client time to start up before proceeding
 
     except Exception as e:
-        logger.error(f"Failed to start Nym client: {e}")
+        logger.error("Failed to start Nym client: %s", e)
         client_process = None
 
 
 def monitor_client():
     """Monitors the Nym client output for errors and restarts if necessary."""
     global client_process
-    while True:
+    tails = {}  # last few bytes per stream, so an "ERROR" split across two reads is still seen
+    while not shutdown_event.is_set():
         if client_process is None or client_process.poll() is not None:
             logger.error("Nym client crashed. Restarting in 10 seconds...")
             time.sleep(10)
             start_client()
+            tails = {}
             continue
 
         try:
-            # Read output from stdout and stderr
-            stdout, stderr = client_process.communicate(timeout=60)
-            output = (stdout + stderr).decode()
-
-            # Check if there's any error (any occurrence of "ERROR")
-            if "ERROR" in output:
-                logger.error(f"Error detected in client output: {output}")
+            # Wait for fresh output and scan only the new bytes, instead of buffering everything
+            streams = [client_process.stdout, client_process.stderr]
+            readable, _, _ = select.select(streams, [], [], 5.0)
+            error_output = None
+            for stream in readable:
+                data = os.read(stream.fileno(), 65536)
+                if not data:
+                    continue
+                chunk = tails.get(stream, b"") + data
+                tails[stream] = chunk[-4:]
+                if b"ERROR" in chunk:
+                    error_output = chunk.decode(errors="replace")
+
+            if error_output is not None:
+                logger.error("Error detected in client output: %s", error_output)
                 client_process.terminate()  # Restart on error
                 time.sleep(2)  # Short wait before restarting
-        except subprocess.TimeoutExpired:
-            logger.info("Nym client is still running, no issues detected.")
         except Exception as e:
-            logger.error(f"Unhandled error while monitoring Nym client: {e}")
-
+            logger.error("Unhandled error while monitoring Nym client: %s", e)
+            time.sleep(1)
 
 
 def graceful_shutdown(signal_received, frame):
     """Handles shutdown signals (SIGINT & SIGTERM) to terminate processes cleanly."""
     logger.info("Graceful shutdown initiated. Sending Ctrl+C to Nym client...")
     shutdown_event.set()  # Signal the monitoring thread to stop
+    if main_loop is not None and not main_loop.is_closed():
+        main_loop.call_soon_threadsafe(stop_event.set)  # Wake main() without it polling
 
-    if client_process is not None:
-        client_process.send_signal(signal.SIGINT)  # Send SIGINT (Ctrl+C)
-        logger.info("Waiting 5 seconds for Nym client to shut down gracefully...")
-        time.sleep(5)  # Give it time to handle cleanup
+    if client_process is not None and client_process.poll() is None:
+        try:
+            os.killpg(client_process.pid, signal.SIGINT)  # Send SIGINT (Ctrl+C) to the client's group
+        except ProcessLookupError:
+            pass  # The client exited between poll() and the signal
+        logger.info("Waiting up to 5 seconds for Nym client to shut down gracefully...")
+        try:
+            client_process.wait(timeout=5)  # Returns as soon as the client has cleaned up
+        except subprocess.TimeoutExpired:
+            logger.warning("Nym client did not exit in time. Killing it.")
+            try:
+                os.killpg(client_process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
         logger.info("Nym client shutdown complete.")
 
     sys.exit(0)
@@ -111,16 +145,15 @@ def graceful_shutdown(signal_received, frame):
 
 async def main():
     """Main asynchronous function handling WebSocket communication."""
+    global stop_event, main_loop
+    stop_event = asyncio.Event()
+    main_loop = asyncio.get_running_loop()
     password = get_encryption_password()
 
-    websocket_url = os.getenv("WEBSOCKET_URL")
-    db_path = os.getenv("DATABASE_PATH", "storage/nym_server.db")
-    key_dir = os.getenv("KEYS_DIR", "storage/keys")
-
-    cryptography_utils = CryptoUtils(key_dir, password)
-    database_manager = DbUtils(db_path)
+    cryptography_utils = CryptoUtils(KEYS_DIR, password)
+    database_manager = DbUtils(DATABASE_PATH)
 
-    websocket_manager = WebsocketUtils(websocket_url)
+    websocket_manager = WebsocketUtils(WEBSOCKET_URL)
     message_handler = MessageUtils(websocket_manager, database_manager, cryptography_utils, password)
 
     websocket_manager.set_message_callback(message_handler.processMessage)
@@ -130,15 +163,23 @@ async def main():
         await websocket_manager.connect()
         logger.info("Waiting for incoming messages...")
 
-        while not shutdown_event.is_set():
-            await asyncio.sleep(1)  # Prevent busy-waiting
+        # Run until shutdown is requested or the reader gives up; either way fall through to cleanup
+        reader = asyncio.create_task(websocket_manager.receive_messages())
+        stopper = asyncio.create_task(stop_event.wait())
+        try:
+            done, _ = await asyncio.wait((reader, stopper), return_when=asyncio.FIRST_COMPLETED)
+            if reader in done:
+                logger.error("Message reader stopped; shutting down.")
+        finally:
+            reader.cancel()
+            stopper.cancel()
 
     except asyncio.CancelledError:
         logger.info("Main coroutine was cancelled.")
     except KeyboardInterrupt:
         logger.info("Received KeyboardInterrupt. Closing gracefully...")
     except Exception as e:
-        logger.error(f"Error occurred: {e}")
+        logger.error("Error occurred: %s", e)
     finally:
         logger.info("Closing connections...")
         await websocket_manager.close()
@@ -159,9 +200,17 @@ if __name__ == "__main__":
     monitoring_thread = threading.Thread(target=monitor_client, daemon=True).start()
     
     # Start the async WebSocket server
+    if uvloop is not None:
+        uvloop.install()
+        logger.info("Using uvloop event loop.")
+
     try:
         asyncio.run(main())  # Run the main async function
     except KeyboardInterrupt:
         logger.info("Application interrupted by user.")
     except asyncio.CancelledError:
-        logger.info("Application shutdown gracefully.")
\ No newline at end of file
+        logger.info("Application shutdown gracefully.")
+
+    if not shutdown_event.is_set():
+        # main() returned without a shutdown signal (the reader gave up); stop the Nym client too
+        graceful_shutdown(None, None)
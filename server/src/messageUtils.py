@@ -1,43 +1,84 @@
-import json
+import asyncio
+import orjson
 import secrets
 import os
 import re
+import time
+from collections import deque
 from cryptography.hazmat.primitives.asymmetric import ec
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.serialization import load_pem_private_key
 from cryptography.hazmat.primitives.asymmetric.utils import encode_dss_signature, decode_dss_signature
 from cryptographyUtils import CryptoUtils
+from websocketUtils import Envelope
 from envLoader import load_env
 from logConfig import logger
 
 load_env()
 
-class MessageUtils:
-    NONCES = {}  # Temporary storage for nonces
-    PENDING_USERS = {}  # Temporary storage for user details during registration
+NYM_CLIENT_ID = os.getenv("NYM_CLIENT_ID")
+KEYS_DIR = os.getenv("KEYS_DIR")
 
-    def __init__(self, websocketManager, databaseManager, crypto_utils, password):
-        NYM_CLIENT_ID = os.getenv("NYM_CLIENT_ID")
-        SERVER_KEY_PATH = os.getenv("KEYS_DIR")
+# Outer reply frame for the nym-client; only the payload and the sender tag vary per reply
+_REPLY_TMPL = '{"type":"reply","message":%s,"senderTag":%s}'
+CHALLENGE_TTL = 120  # seconds a registration/login challenge stays answerable; mixnet round trips take a while
+STATIC_REPLY_CACHE_SIZE = 64  # signed status replies ("success", "error: ...") kept per (content, action, context)
 
+class MessageUtils:
+    def __init__(self, websocketManager, databaseManager, crypto_utils, password):
+        self.NONCES = {}  # Pending login challenges by senderTag
+        self.PENDING_USERS = {}  # Pending registrations by senderTag
+        # (deadline, store, senderTag, details) in insertion order, so expired challenges pop off the left
+        self._challenge_expiry = deque()
         self.websocketManager = websocketManager
         self.databaseManager = databaseManager
-        self.cryptoUtils = CryptoUtils(SERVER_KEY_PATH, password)
-
-        private_key_path = os.path.join(os.getenv("KEYS_DIR"), f"{NYM_CLIENT_ID}_private_key.enc")
+        self.cryptoUtils = CryptoUtils(KEYS_DIR, password)
+        # Status replies never change, so each is signed and encoded once and reused for every recipient
+        self._static_replies = {}
+
+        private_key_path = os.path.join(KEYS_DIR, f"{NYM_CLIENT_ID}_private_key.enc")
+
+        # Action -> handler, built once instead of walking an if/elif chain per message
+        self.handlers = {
+            "query": self.handleQuery,
+            "register": self.handleRegister,
+            "login": self.handleLogin,
+            "registrationResponse": self.handleRegistrationResponse,
+            "send": self.handleSend,
+            "loginResponse": self.handleLoginResponse,
+        }
 
         # Ensure the server's key pair exists
         if not os.path.exists(private_key_path):
             self.cryptoUtils.generate_key_pair(NYM_CLIENT_ID)
             logger.info("Init - Server key pair generated.")
 
+    def _putChallenge(self, store, senderTag, details):
+        """Record a pending challenge in store (NONCES or PENDING_USERS) that expires after CHALLENGE_TTL."""
+        self._expireChallenges()
+        store[senderTag] = details
+        self._challenge_expiry.append((time.monotonic() + CHALLENGE_TTL, store, senderTag, details))
+
+    def _expireChallenges(self):
+        """Drop challenges past their deadline; abandoned registrations/logins would otherwise pile up."""
+        now = time.monotonic()
+        expiry = self._challenge_expiry
+        while expiry and expiry[0][0] <= now:
+            _, store, senderTag, details = expiry.popleft()
+            if store.get(senderTag) is details:  # not answered or replaced by a newer challenge
+                del store[senderTag]
+
     @staticmethod
     def is_valid_username(username):
         """Validates that the username contains only letters, numbers, '-', or '_'"""
         return bool(re.fullmatch(r"[A-Za-z0-9_-]+", username))
 
+    async def verifySignature(self, publicKeyPem, message, signature):
+        """ECDSA verification runs in a worker thread so a burst of logins/sends doesn't stall the loop."""
+        return await asyncio.to_thread(self.cryptoUtils.verify_signature, publicKeyPem, message, signature)
+
     async def processMessage(self, messageData):
-        messageType = messageData.get("type")
+        messageType = messageData.type
 
         if messageType == "received":
             await self.processReceivedMessage(messageData)
@@ -45,36 +86,25 @@ class MessageUtils:
             logger.error(f"processMessaage - Unknown message type :( | {messageType}")
 
     async def processReceivedMessage(self, messageData):
-        encapsulatedJson = messageData.get("message")
-        senderTag = messageData.get("senderTag")
+        encapsulatedJson = messageData.message
+        senderTag = messageData.senderTag
 
         try:
-            encapsulatedData = json.loads(encapsulatedJson)
+            encapsulatedData = orjson.loads(encapsulatedJson)
+            if "batch" in encapsulatedData:
+                # Client coalesced several messages into a single mixnet send
+                for item in encapsulatedData["batch"]:
+                    await self.processReceivedMessage(Envelope("received", item, senderTag))
+                return
+
             action = encapsulatedData.get("action")
 
-            if action == "query":
-                await self.handleQuery(encapsulatedData, senderTag)
-            elif action == "register":
-                await self.handleRegister(encapsulatedData, senderTag)
-            elif action == "login":
-                await self.handleLogin(encapsulatedData, senderTag)
-            elif action == "registrationResponse":
-                await self.handleRegistrationResponse(encapsulatedData, senderTag)
-            elif action == "update":
-                await self.handleUpdate(encapsulatedData, senderTag)
-            elif action == "send":
-                await self.handleSend(encapsulatedData, senderTag)
-            elif action == "sendGroup":
-                await self.handleSendGroup(encapsulatedData, senderTag)
-            elif action == "createGroup":
-                await self.handleCreateGroup(encapsulatedData, senderTag)
-            elif action == "inviteGroup":
-                await self.handleSendInvite(encapsulatedData, senderTag)
-            elif action == "loginResponse":
-                await self.handleLoginResponse(encapsulatedData, senderTag)
+            handler = self.handlers.get(action)
+            if handler:
+                await handler(encapsulatedData, senderTag)
             else:
                 logger.error(f"processReceivedMessage - Unknown encapsulated action :( | {action}")
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             logger.error(f"processReceivedMessage - Decoding JSON :( | {e}")
 
     async def handleSend(self, messageData, senderTag):
@@ -98,8 +128,8 @@ class MessageUtils:
 
         # Parse the inner JSON for actual message details.
         try:
-            content_dict = json.loads(content_str)
-        except json.JSONDecodeError:
+            content_dict = orjson.loads(content_str)
+        except orjson.JSONDecodeError:
             await self.sendEncapsulatedReply(
                 senderTag,
                 "error: invalid JSON in content",
@@ -123,7 +153,7 @@ class MessageUtils:
             return
 
         # Look up the sender by username.
-        senderRecord = self.databaseManager.getUserByUsername(sender_username)
+        senderRecord = await self.databaseManager.fetchUserByUsername(sender_username)
         if not senderRecord:
             await self.sendEncapsulatedReply(
                 senderTag,
@@ -139,7 +169,7 @@ class MessageUtils:
         dbPublicKey = senderRecord[1]
 
         # Verify the signature using the sender's public key.
-        if not self.cryptoUtils.verify_signature(dbPublicKey, content_str, signature):
+        if not await self.verifySignature(dbPublicKey, content_str, signature):
             await self.sendEncapsulatedReply(
                 senderTag,
                 "error: invalid signature",
@@ -151,10 +181,10 @@ class MessageUtils:
 
         # Check if the senderTag has changed.
         if dbSenderTag != senderTag:
-            self.databaseManager.updateUserField(sender_username, "senderTag", senderTag)
+            await self.databaseManager.write(self.databaseManager.updateUserField, sender_username, "senderTag", senderTag)
 
         # Look up the recipient by username.
-        targetUser = self.databaseManager.getUserByUsername(recipient_username)
+        targetUser = await self.databaseManager.fetchUserByUsername(recipient_username)
         if not targetUser:
             await self.sendEncapsulatedReply(
                 senderTag,
@@ -180,7 +210,7 @@ class MessageUtils:
         # Forward the message to the recipient.
         await self.sendEncapsulatedReply(
             targetSenderTag,
-            json.dumps(forwardPayload),
+            orjson.dumps(forwardPayload).decode(),
             action="incomingMessage",
             context="chat"
         )
@@ -218,7 +248,7 @@ class MessageUtils:
             return
 
         # Look up the user record in the DB
-        user = self.databaseManager.getUserByUsername(target_username)
+        user = await self.databaseManager.fetchUserByUsername(target_username)
         if user:
             # Depending on your schema, user might be (username, publicKey, senderTag, ...)
             # We'll just extract the first two.
@@ -232,7 +262,7 @@ class MessageUtils:
 
             await self.sendEncapsulatedReply(
                 senderTag,
-                json.dumps(user_data),
+                orjson.dumps(user_data).decode(),
                 action="queryResponse",
                 context="query"
             )
@@ -257,19 +287,20 @@ class MessageUtils:
             await self.sendEncapsulatedReply(senderTag, "error: invalid username format", action="challengeResponse", context="registration")
             return
 
-        if self.databaseManager.getUserByUsername(username):
+        if await self.databaseManager.fetchUserByUsername(username):
             await self.sendEncapsulatedReply(senderTag, "error: username already in use", action="challengeResponse", context="registration")
             return
 
         # Generate a nonce and store it in PENDING_USERS
         nonce = secrets.token_hex(16)
-        self.PENDING_USERS[senderTag] = (username, publicKey, nonce)
+        self._putChallenge(self.PENDING_USERS, senderTag, (username, publicKey, nonce))
         logger.info("handleRegister - sending challenge")
         # Send the challenge to the client
-        await self.sendEncapsulatedReply(senderTag, json.dumps({"nonce": nonce}), action="challenge", context="registration")
+        await self.sendEncapsulatedReply(senderTag, orjson.dumps({"nonce": nonce}).decode(), action="challenge", context="registration")
 
     async def handleRegistrationResponse(self, messageData, senderTag):
         signature = messageData.get("signature")
+        self._expireChallenges()
         user_details = self.PENDING_USERS.get(senderTag)
 
         if not user_details:
@@ -280,16 +311,16 @@ class MessageUtils:
         username, publicKey, nonce = user_details
 
         # Verify the signature
-        if self.cryptoUtils.verify_signature(publicKey, nonce, signature):
-            if self.databaseManager.addUser(username, publicKey, senderTag):
+        if await self.verifySignature(publicKey, nonce, signature):
+            if await self.databaseManager.write(self.databaseManager.addUser, username, publicKey, senderTag):
                 await self.sendEncapsulatedReply(senderTag, "success", action="challengeResponse", context="registration")
-                del self.PENDING_USERS[senderTag]  # Clean up after successful registration
+                self.PENDING_USERS.pop(senderTag, None)  # Clean up after successful registration
                 logger.info("handleRegistrationResponse - registration successful")
             else:
                 await self.sendEncapsulatedReply(senderTag, "error: database failure", action="challengeResponse", context="registration")
         else:
             await self.sendEncapsulatedReply(senderTag, "error: signature verification failed", action="challengeResponse", context="registration")
-            del self.PENDING_USERS[senderTag]  # Clean up after failed verification
+            self.PENDING_USERS.pop(senderTag, None)  # Clean up after failed verification
             logger.warning("handleRegistrationResponse - registration failed :(")
 
     async def handleLogin(self, messageData, senderTag):
@@ -303,7 +334,7 @@ class MessageUtils:
             logger.warning("handleLogin - missing username :(")
             return
 
-        user = self.databaseManager.getUserByUsername(username)
+        user = await self.databaseManager.fetchUserByUsername(username)
         if not user:
             await self.sendEncapsulatedReply(senderTag, "error: user not found", action="challengeResponse", context="login")
             logger.warning("handleLogin - user not found in DB :(")
@@ -311,10 +342,10 @@ class MessageUtils:
 
         # Generate a nonce and store it
         nonce = secrets.token_hex(16)
-        self.NONCES[senderTag] = (username, user[1], nonce)  # user[1] is the public key
+        self._putChallenge(self.NONCES, senderTag, (username, user[1], nonce))  # user[1] is the public key
 
         # Send the challenge to the client
-        await self.sendEncapsulatedReply(senderTag, json.dumps({"nonce": nonce}), action="challenge", context="login")
+        await self.sendEncapsulatedReply(senderTag, orjson.dumps({"nonce": nonce}).decode(), action="challenge", context="login")
         logger.info("handleLogin - sending challenge")
 
     async def handleLoginResponse(self, messageData, senderTag):
@@ -322,6 +353,7 @@ class MessageUtils:
         Handle the login response from the client.
         """
         signature = messageData.get("signature")
+        self._expireChallenges()
         user_details = self.NONCES.get(senderTag)
 
         if not user_details:
@@ -337,15 +369,15 @@ class MessageUtils:
         username, publicKey, nonce = user_details
 
         # Verify the signature
-        if self.cryptoUtils.verify_signature(publicKey, nonce, signature):
+        if await self.verifySignature(publicKey, nonce, signature):
             # Look up the user in the database
-            userRecord = self.databaseManager.getUserByUsername(username)
+            userRecord = await self.databaseManager.fetchUserByUsername(username)
             if userRecord:
                 dbSenderTag = userRecord[2]  # Stored senderTag
 
                 # If the senderTag has changed, update it in the database
                 if dbSenderTag != senderTag:
-                    self.databaseManager.updateUserField(username, "senderTag", senderTag)
+                    await self.databaseManager.write(self.databaseManager.updateUserField, username, "senderTag", senderTag)
 
             await self.sendEncapsulatedReply(
                 senderTag,
@@ -353,7 +385,7 @@ class MessageUtils:
                 action="challengeResponse",
                 context="login"
             )
-            del self.NONCES[senderTag]  # Clean up after successful login
+            self.NONCES.pop(senderTag, None)  # Clean up after successful login
             logger.info("handleLoginResponse - success!")
         else:
             await self.sendEncapsulatedReply(
@@ -362,7 +394,7 @@ class MessageUtils:
                 action="challengeResponse",
                 context="login"
             )
-            del self.NONCES[senderTag]
+            self.NONCES.pop(senderTag, None)
             logger.warning("handleLoginResponse - invalid signature :(")
 
     async def sendEncapsulatedReply(self, recipientTag, content, action="challengeResponse", context=None):
@@ -373,25 +405,31 @@ class MessageUtils:
         :param action: The action type of the reply (default is "challengeResponse").
         :param context: Additional context for the reply (e.g., 'registration').
         """
-        # Load the server's private key
-        private_key = self.cryptoUtils.load_private_key(os.getenv("NYM_CLIENT_ID"))
-        if private_key is None:
-            logger.error("sendEncapsulatedReply - server priv key not found :(")
-            return
-        
-        signature = self.cryptoUtils.sign_message(os.getenv("NYM_CLIENT_ID"), content)
-        if signature is None:
-            logger.error("sendEncapsulatedReply - failed to sign message :(")
-            return
-
-        replyMessage = {
-            "type": "reply",
-            "message": json.dumps({
+        key = (content, action, context)
+        message = self._static_replies.get(key)
+        if message is None:
+            # Load the server's private key
+            private_key = self.cryptoUtils.load_private_key(NYM_CLIENT_ID)
+            if private_key is None:
+                logger.error("sendEncapsulatedReply - server priv key not found :(")
+                return
+
+            signature = self.cryptoUtils.sign_message(NYM_CLIENT_ID, content)
+            if signature is None:
+                logger.error("sendEncapsulatedReply - failed to sign message :(")
+                return
+
+            encapsulated = orjson.dumps({
                 "action": action,
                 "content": content,
                 "context": context,
                 "signature": signature
-            }),
-            "senderTag": recipientTag
-        }
+            })
+            # The payload travels as a JSON string inside the frame, so it is encoded once more as a str
+            message = orjson.dumps(encapsulated.decode()).decode()
+            # JSON contents carry per-request data (nonces, user records, forwarded messages); only plain statuses repeat
+            if not content.startswith("{") and len(self._static_replies) < STATIC_REPLY_CACHE_SIZE:
+                self._static_replies[key] = message
+
+        replyMessage = _REPLY_TMPL % (message, orjson.dumps(recipientTag).decode())
         await self.websocketManager.send(replyMessage)
@@ -1,11 +1,18 @@
 import asyncio
-import json
 import os
+import msgspec
+import orjson
 import websockets
 from logConfig import logger
-from envLoader import load_env
 
-load_env()
+class Envelope(msgspec.Struct):
+    """Outer frame from the Nym client; fields other than these are skipped while decoding."""
+    type: str
+    message: str = ""
+    senderTag: str | None = None
+
+_ENVELOPE_DECODER = msgspec.json.Decoder(Envelope)
+INBOUND_QUEUE_SIZE = 1024  # raw frames buffered between the socket reader and the processor
 
 class WebsocketUtils:
     def __init__(self, server_url=None):
@@ -13,14 +20,16 @@ class WebsocketUtils:
         self.websocket = None
         self.message_callback = None  # Callback for processing messages
         self.address = None # store the address
+        self._in_q = asyncio.Queue(maxsize=INBOUND_QUEUE_SIZE)
+        self._processor_task = None
 
     async def connect(self):
         """Establish a WebSocket connection with the Nym client."""
         try:
             self.websocket = await websockets.connect(self.server_url)
-            await self.websocket.send(json.dumps({"type": "selfAddress"}))
+            await self.websocket.send(orjson.dumps({"type": "selfAddress"}).decode())
             response = await self.websocket.recv()
-            data = json.loads(response)
+            data = orjson.loads(response)
             
             # Store address and validate
             self.address = data.get("address")
@@ -59,43 +68,70 @@ class WebsocketUtils:
             except IOError as e:
                 logger.error(f"Failed to write address to file: {e}")
                 # Continue execution - failure to write file shouldn't crash the server
-
-            # Start listening for incoming messages
-            await self.receive_messages()
         except Exception as e:
             logger.error(f"Connection error: {e}")
             raise  # Re-raise to signal failure up the stack
 
     async def receive_messages(self):
-        """Listen for incoming messages and forward them to the callback."""
-        try:
-            while True:
+        """Read frames off the socket and queue them for _process_messages."""
+        if self._processor_task is None or self._processor_task.done():
+            self._processor_task = asyncio.create_task(self._process_messages())
+        attempt = 0
+        while True:
+            try:
                 raw_message = await self.websocket.recv()
-                logger.info("Message received")
-                message_data = json.loads(raw_message)
+            except websockets.exceptions.ConnectionClosed:
+                # Reconnect inline with backoff; a closed socket is usually the local nym-client restarting
+                delay = min(2 ** attempt, 30)
+                attempt += 1
+                logger.warning(f"Connection closed by the server. Reconnecting in {delay}s...")
+                await asyncio.sleep(delay)
+                try:
+                    self.websocket = await websockets.connect(self.server_url)
+                    logger.info("Reconnected to WebSocket.")
+                except Exception as e:
+                    logger.error(f"Reconnect failed: {e}")
+                continue
+            except Exception as e:
+                logger.error(f"Error while receiving messages: {e}")
+                return
+
+            attempt = 0
+            logger.debug("Message received")
+            # Blocks only when the processor is INBOUND_QUEUE_SIZE frames behind, pushing back on the socket
+            await self._in_q.put(raw_message)
+
+    async def _process_messages(self):
+        """Decode queued frames and forward them to the callback, one at a time and in order."""
+        while True:
+            raw_message = await self._in_q.get()
+            # A bad frame or a failing handler is logged and skipped; it must not end the processor
+            try:
+                message_data = _ENVELOPE_DECODER.decode(raw_message)
 
                 # Call the callback for further processing
                 if self.message_callback:
                     await self.message_callback(message_data)
                 else:
                     logger.warning("No callback set for processing messages.")
-        except websockets.exceptions.ConnectionClosed:
-            logger.warning("Connection closed by the server.")
-        except Exception as e:
-            logger.error(f"Error while receiving messages: {e}")
-            
+            except Exception as e:
+                logger.error(f"Error while processing message: {e}")
+
     async def send(self, message):
         """Send a message through the WebSocket."""
         try:
             if isinstance(message, dict):
-                message = json.dumps(message)
+                # The nym-client reads JSON requests from text frames only; bytes would go out as a binary frame
+                message = orjson.dumps(message).decode()
             await self.websocket.send(message)
-            logger.info("Message sent")
+            logger.debug("Message sent")
         except Exception as e:
             logger.error(f"Error sending message: {e}")
 
     async def close(self):
         """Close the websocket connection."""
+        if self._processor_task is not None:
+            self._processor_task.cancel()
         if self.websocket:
             try:
                 await self.websocket.close()